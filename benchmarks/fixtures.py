@@ -0,0 +1,70 @@
+import os
+import random
+import shutil
+import fitz  # PyMuPDF
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_PDF = os.path.join(REPO_ROOT, "uploaded_file.pdf")
+
+WORDS = (
+    "model data learning network training results method analysis performance accuracy "
+    "dataset evaluation baseline experiment feature layer attention transformer gradient "
+    "optimization loss benchmark inference architecture parameter sample distribution "
+    "signal protein market inflation patient clinical policy theory estimate robust"
+).split()
+
+
+def _paragraph(rng, sentences=6):
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def write_synthetic_pdf(path, pages, seed):
+    """
+    Write a text PDF of `pages` pages that looks like a paper to the pipeline:
+    a large title, an author line, an abstract and numbered sections.
+
+    The text is generated from `seed`, so each seed gives a distinct
+    document and the same seed always gives the same one.
+    """
+    rng = random.Random(seed)
+    with fitz.open() as pdf:
+        for page_number in range(pages):
+            page = pdf.new_page()
+            y = 72
+            if page_number == 0:
+                page.insert_text((72, y), f"Synthetic Study {seed} of {rng.choice(WORDS).title()} Models",
+                                 fontsize=18)
+                y += 30
+                page.insert_text((72, y), "Ada Lovelace, Alan Turing", fontsize=11)
+                y += 28
+                page.insert_textbox(fitz.Rect(72, y, 540, y + 140), "Abstract " + _paragraph(rng, 5), fontsize=9)
+                y += 150
+            page.insert_text((72, y), f"{page_number + 1}. {rng.choice(WORDS).title()}", fontsize=12)
+            page.insert_textbox(fitz.Rect(72, y + 10, 540, 760), "\n\n".join(_paragraph(rng) for _ in range(4)),
+                                fontsize=9)
+        pdf.metadata = {**pdf.metadata, "title": f"Synthetic Study {seed}", "creationDate": "D:20240101000000"}
+        pdf.save(path)
+    return path
+
+
+def build_corpus(directory, page_counts=(1, 5, 20, 50), copies=1, include_bundled=True):
+    """
+    Write the benchmark corpus into `directory` and return its PDF paths.
+
+    The corpus holds the bundled `uploaded_file.pdf` and `copies` distinct
+    synthetic PDFs for each page count.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    if include_bundled:
+        paths.append(shutil.copy(BUNDLED_PDF, os.path.join(directory, "uploaded_file.pdf")))
+    seed = 0
+    for pages in page_counts:
+        for copy in range(copies):
+            seed += 1
+            paths.append(write_synthetic_pdf(os.path.join(directory, f"synthetic_{pages}p_{copy}.pdf"), pages, seed))
+    return paths
@@ -0,0 +1,192 @@
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server:
+    """Run a ThreadingHTTPServer on a free local port in a daemon thread."""
+
+    handler = None
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _completion_text(body):
+    """A plausible response for the pipeline's prompts, shaped the way each node parses it."""
+    system = body["messages"][0]["content"]
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return json.dumps({
+            "summary": "A synthetic summary of the benchmark document.",
+            "title": "Synthetic Benchmark Document",
+            "authors": ["Ada Lovelace", "Alan Turing"],
+            "publication_date": "2024-01-01",
+            "abstract": "A synthetic abstract.",
+            "key_findings": ["Finding one", "Finding two"],
+            "methodology": "Synthetic methodology.",
+        })
+    if "metadata" in system.lower():
+        return (
+            "**Title:** Synthetic Benchmark Document\n"
+            "**Authors:** Ada Lovelace, Alan Turing\n"
+            "**Publication Date:** 2024-01-01\n"
+            "**Abstract:** A synthetic abstract."
+        )
+    return "A synthetic summary of the benchmark document, written by the mock server."
+
+
+class _MockOpenAIHandler(_QuietHandler):
+    def do_POST(self):
+        server = self.server.owner
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, b'{"error": {"message": "not found"}}')
+            return
+
+        server.requests += 1
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency_jitter)))
+        if server.rate_limit_rate and random.random() < server.rate_limit_rate:
+            error = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            self._send(429, json.dumps(error).encode(), headers={"retry-after-ms": str(server.retry_after_ms)})
+            return
+
+        text = _completion_text(body)
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        completion_tokens = len(text) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        common = {"id": f"chatcmpl-{server.requests}", "created": int(time.time()), "model": body.get("model")}
+
+        if not body.get("stream"):
+            response = {**common, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+            ]}
+            self._send(200, json.dumps(response).encode())
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunk = {**common, "object": "chat.completion.chunk"}
+        for word in text.split(" "):
+            delta = {"index": 0, "finish_reason": None, "delta": {"content": word + " "}}
+            self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [delta]})}\n\n".encode())
+        stop = {"index": 0, "finish_reason": "stop", "delta": {}}
+        self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [stop]})}\n\n".encode())
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.wfile.write(f"data: {json.dumps({**chunk, 'choices': [], 'usage': usage})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class MockOpenAIServer(_Server):
+    """
+    Local stand-in for the chat completions API.
+
+    Each request sleeps for a normally distributed `latency` (seconds) and
+    answers in the format the requesting node expects; a `rate_limit_rate`
+    share of requests get a 429 with `retry-after-ms`, which exercises the
+    request scheduler's backoff. Streaming and `include_usage` are supported.
+    """
+
+    handler = _MockOpenAIHandler
+
+    def __init__(self, latency=0.2, latency_jitter=0.05, rate_limit_rate=0.0, retry_after_ms=100):
+        super().__init__()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.requests = 0
+
+
+class _MockScholarHandler(_QuietHandler):
+    def do_GET(self):
+        server = self.server.owner
+        url = urlparse(self.path)
+        time.sleep(server.latency)
+        if url.path == "/scholar":
+            query = parse_qs(url.query)
+            start = int(query.get("start", ["0"])[0])
+            server.search_requests += 1
+            recorded = server.recorded_pages.get((query.get("q", [""])[0], start))
+            if recorded is not None:
+                self._send(200, recorded.encode(), "text/html")
+                return
+            names = server.pdf_names[start:start + server.page_size]
+            rows = "".join(
+                f'<div class="gs_r"><div class="gs_or_ggsm"><a href="{server.url}/pdf/{name}">[PDF]</a></div></div>'
+                for name in names
+            )
+            self._send(200, f"<html><body>{rows}</body></html>".encode(), "text/html")
+        elif url.path.startswith("/pdf/") and os.path.basename(url.path) in server.pdfs:
+            with open(server.pdfs[os.path.basename(url.path)], "rb") as f:
+                self._send(200, f.read(), "application/pdf")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+
+class MockScholarServer(_Server):
+    """
+    Local stand-in for Google Scholar and the hosts it links to.
+
+    `/scholar?q=...&start=N` lists `page_size` `[PDF]` links per page, in the
+    markup the scraper reads, and `/pdf/<name>` serves the files in `pdfs`
+    (a name -> path mapping). `recorded_pages` maps `(query, start)` to the
+    HTML of a saved result page, served instead for that query and page.
+    Every response waits `latency` seconds.
+    """
+
+    handler = _MockScholarHandler
+
+    def __init__(self, pdfs, latency=0.0, page_size=10, recorded_pages=None):
+        super().__init__()
+        self.pdfs = dict(pdfs)
+        self.pdf_names = sorted(self.pdfs)
+        self.latency = latency
+        self.page_size = page_size
+        self.recorded_pages = dict(recorded_pages or {})
+        self.search_requests = 0
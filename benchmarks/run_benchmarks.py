@@ -0,0 +1,270 @@
+"""
+Benchmark the pipeline against local mock servers.
+
+    python benchmarks/run_benchmarks.py --output results.json
+
+Measures extraction pages/sec, downloader MB/s, paginated Scholar search
+time (sequential, concurrent and cached), workflow latency and throughput
+at several concurrency levels, and end-to-end docs/sec of the batch CLI.
+No network access or API key is needed: LLM calls go to a mock OpenAI
+server and searches and downloads to a mock Scholar/PDF host.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+from fixtures import REPO_ROOT, build_corpus  # noqa: E402
+from mock_servers import MockOpenAIServer, MockScholarServer  # noqa: E402
+
+sys.path.insert(0, os.path.join(REPO_ROOT, "main"))
+
+DEFAULT_TASKS = ["Summary", "Metadata Extraction"]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Silence the pipeline's progress prints while a benchmark runs."""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_extraction(paths, workdir, max_pages):
+    from data_processor import ExtractionCache, extract_pdfs, extract_text_from_pdf
+
+    cache = ExtractionCache(tempfile.mkdtemp(prefix="extraction-", dir=workdir))
+    start = time.perf_counter()
+    results = extract_pdfs(paths, max_pages=max_pages, cache=cache)
+    parallel_seconds = time.perf_counter() - start
+    pages = sum(min(result["page_count"], max_pages) for result in results)
+
+    start = time.perf_counter()
+    extract_pdfs(paths, max_pages=max_pages, cache=cache)
+    cached_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        extract_text_from_pdf(path, max_pages=max_pages)
+    sequential_seconds = time.perf_counter() - start
+
+    return {
+        "files": len(paths),
+        "pages": pages,
+        "parallel_pages_per_sec": pages / parallel_seconds,
+        "sequential_pages_per_sec": pages / sequential_seconds,
+        "cached_pages_per_sec": pages / cached_seconds,
+    }
+
+
+def bench_downloader(scholar, workdir, workers):
+    from data_downloader import PDFDownloader
+
+    target = tempfile.mkdtemp(prefix="downloads-", dir=workdir)
+    downloader = PDFDownloader(max_workers=workers, per_host_limit=workers)
+    downloads = [(f"{scholar.url}/pdf/{name}", os.path.join(target, name)) for name in scholar.pdf_names]
+    start = time.perf_counter()
+    results = downloader.download_many(downloads)
+    seconds = time.perf_counter() - start
+    total = sum(os.path.getsize(path) for _, path in downloads if os.path.exists(path))
+    return {
+        "files": len(downloads),
+        "succeeded": sum(results.values()),
+        "megabytes": total / 1e6,
+        "megabytes_per_sec": total / 1e6 / seconds,
+        "workers": workers,
+    }
+
+
+def bench_search(pdfs, workdir, topics, num_results, latency, workers):
+    from scholar_search import HostRateLimiter, ScholarSearch, SearchCache
+
+    with MockScholarServer(pdfs, latency=latency) as scholar:
+        def make_search():
+            cache = SearchCache(tempfile.mkdtemp(prefix="search-", dir=workdir))
+            return ScholarSearch(f"{scholar.url}/scholar", cache=cache, rate_limiter=HostRateLimiter(0.0),
+                                 max_workers=workers)
+
+        search = make_search()
+        start = time.perf_counter()
+        for topic in topics:
+            search.search(topic, num_results)
+        sequential_seconds = time.perf_counter() - start
+
+        search = make_search()
+        start = time.perf_counter()
+        links = dict(search.search_many(topics, num_results))
+        concurrent_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        dict(search.search_many(topics, num_results))
+        cached_seconds = time.perf_counter() - start
+
+    return {
+        "topics": len(topics),
+        "links_per_topic": statistics.mean(len(found) for found in links.values()),
+        "sequential_seconds": sequential_seconds,
+        "concurrent_seconds": concurrent_seconds,
+        "cached_seconds": cached_seconds,
+        "page_latency": latency,
+        "workers": workers,
+    }
+
+
+def bench_workflow(texts, levels, runs_per_level, tasks):
+    from langchain_core.messages import HumanMessage
+    from langgraph_workflow import get_workflow, run_workflow
+
+    workflow = get_workflow(tasks)
+    results = []
+    for concurrency in levels:
+        def run_one(index):
+            # A distinct header per run, so every run misses the LLM cache
+            content = f"Benchmark run {concurrency}.{index}\n\n{texts[index % len(texts)]}"
+            start = time.perf_counter()
+            run_workflow(workflow, {"messages": [HumanMessage(content=content)]})
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(run_one, range(runs_per_level)))
+        seconds = time.perf_counter() - start
+        results.append({
+            "concurrency": concurrency,
+            "runs": runs_per_level,
+            "docs_per_sec": runs_per_level / seconds,
+            "p50_seconds": statistics.median(latencies),
+            "p95_seconds": percentile(latencies, 0.95),
+        })
+    return results
+
+
+def bench_end_to_end(workdir, num_docs, concurrency, tasks):
+    import main as pipeline
+
+    base_folder = tempfile.mkdtemp(prefix="e2e-", dir=workdir)
+    checkpoint = os.path.join(base_folder, "checkpoint.jsonl")
+    start = time.perf_counter()
+    pipeline.main([
+        "full", "--topic", "benchmark", "--num_results", str(num_docs), "--base_folder", base_folder,
+        "--checkpoint", checkpoint, "--concurrency", str(concurrency), "--max_pages", "30", "--tasks", *tasks,
+    ])
+    seconds = time.perf_counter() - start
+    completed = 0
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            completed = sum(1 for line in f if line.strip())
+    return {"documents": completed, "seconds": seconds, "docs_per_sec": completed / seconds,
+            "concurrency": concurrency}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--llm_latency", type=float, default=0.2, help="Mean mock LLM latency in seconds")
+    parser.add_argument("--llm_rate_limit_rate", type=float, default=0.0, help="Share of LLM requests answered 429")
+    parser.add_argument("--host_latency", type=float, default=0.0, help="Mock Scholar/PDF host latency in seconds")
+    parser.add_argument("--search_latency", type=float, default=0.1, help="Mock Scholar latency in the search benchmark")
+    parser.add_argument("--search_topics", type=int, default=8, help="Topics searched in the search benchmark")
+    parser.add_argument("--search_results", type=int, default=25, help="PDF links requested per topic")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--runs", type=int, default=32, help="Workflow runs per concurrency level")
+    parser.add_argument("--documents", type=int, default=10, help="Documents in the end-to-end run")
+    parser.add_argument("--page_counts", type=int, nargs="+", default=[1, 5, 20, 50])
+    parser.add_argument("--copies", type=int, default=3, help="Synthetic PDFs per page count")
+    parser.add_argument("--max_pages", type=int, default=30)
+    parser.add_argument("--tasks", nargs="+", default=DEFAULT_TASKS)
+    parser.add_argument("--quick", action="store_true", help="A small run for smoke-testing the harness")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.concurrency, args.runs, args.documents, args.copies = [1, 4], 8, 4, 1
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output or os.path.join(
+        BENCHMARK_DIR, "results", f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    ))
+    workdir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    original_cwd = os.getcwd()
+    try:
+        corpus = build_corpus(os.path.join(workdir, "corpus"), args.page_counts, args.copies)
+        with MockOpenAIServer(latency=args.llm_latency, latency_jitter=args.llm_latency / 4,
+                              rate_limit_rate=args.llm_rate_limit_rate) as llm, \
+                MockScholarServer({os.path.basename(path): path for path in corpus}, latency=args.host_latency) as scholar:
+            # Configure the pipeline before its modules are imported; caches and
+            # sinks live in the scratch directory so every run starts cold
+            os.environ.update({
+                "OPENAI_BASE_URL": f"{llm.url}/v1",
+                "OPENAI_API_KEY": "benchmark",
+                "OPENAI_RPM": "1000000",
+                "OPENAI_TPM": "1000000000",
+                "SCHOLAR_URL": f"{scholar.url}/scholar",
+                "SCHOLAR_MIN_INTERVAL": "0",
+                "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.sqlite"),
+                "PIPELINE_SQLITE_SINK": os.path.join(workdir, "sink.sqlite"),
+            })
+            os.chdir(workdir)
+
+            from data_processor import extract_text_from_pdf
+
+            results = {
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+            }
+            with quiet(not args.verbose):
+                results["extraction"] = bench_extraction(corpus, workdir, args.max_pages)
+                results["downloader"] = bench_downloader(scholar, workdir, max(args.concurrency))
+                # Enough distinct links that every search pages through several result pages
+                links = {f"result_{index}.pdf": corpus[index % len(corpus)] for index in range(args.search_results)}
+                results["search"] = bench_search(
+                    links, workdir, [f"topic {index}" for index in range(args.search_topics)], args.search_results,
+                    args.search_latency, max(args.concurrency),
+                )
+                texts = [extract_text_from_pdf(path, max_pages=args.max_pages) for path in corpus]
+                results["workflow"] = bench_workflow(texts, args.concurrency, args.runs, args.tasks)
+                results["end_to_end"] = bench_end_to_end(workdir, args.documents, max(args.concurrency), args.tasks)
+            results["llm_requests"] = llm.requests
+    finally:
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import importlib
+import os
+import sys
+import threading
+
+
+# Seconds a single OpenAI request may take before the client gives up on it
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", 60))
+
+_factories = {}
+_instances = {}
+# Reentrant, since a factory may ask for another backend (the scheduler needs the client)
+_lock = threading.RLock()
+
+
+def get_setting(name, default=None):
+    """
+    Read a setting from the environment, then from Streamlit secrets.
+
+    Secrets are only consulted when the app already imported Streamlit, so
+    batch workers never pay for importing it.
+    """
+    value = os.environ.get(name)
+    if value:
+        return value
+    if "streamlit" in sys.modules:
+        try:
+            return sys.modules["streamlit"].secrets.get(name, default)
+        except Exception:  # No secrets.toml
+            pass
+    return default
+
+
+def register_backend(name, factory):
+    """
+    Register how to build backend `name`.
+
+    `factory` is a zero-argument callable or a "module:attribute" path to
+    one; a path is only imported when the backend is first requested. The
+    environment variable BACKEND_<NAME> (e.g. BACKEND_SENTIMENT) overrides
+    the registered factory with another path.
+    """
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def _load_factory(factory):
+    if isinstance(factory, str):
+        module_name, _, attribute = factory.partition(":")
+        return getattr(importlib.import_module(module_name), attribute)
+    return factory
+
+
+def get_backend(name):
+    """Return backend `name`, building it on first use."""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            factory = os.environ.get(f"BACKEND_{name.upper()}") or _factories.get(name)
+            if factory is None:
+                raise KeyError(f"Unknown backend: {name}")
+            _instances[name] = _load_factory(factory)()
+        return _instances[name]
+
+
+def loaded_backends():
+    """Names of the backends built so far in this process."""
+    return sorted(_instances)
+
+
+def reset_backends():
+    """Drop every built backend, so the next request builds it again from the current settings."""
+    with _lock:
+        _instances.clear()
+
+
+def create_openai_client():
+    from openai import AsyncOpenAI
+
+    # Retries are left to the scheduler, which knows about the rate limits
+    return AsyncOpenAI(api_key=get_setting("OPENAI_API_KEY"), max_retries=0, timeout=OPENAI_TIMEOUT)
+
+
+def create_llm_scheduler():
+    from llm_scheduler import RequestScheduler
+
+    return RequestScheduler.from_env(get_backend("openai"))
+
+
+def create_workflow_checkpointer():
+    """
+    Open the SQLite store of LangGraph checkpoints at WORKFLOW_CHECKPOINT_PATH.
+
+    Workflow runs prune their thread to its latest checkpoint, so the file
+    holds one checkpoint per document.
+
+    Returns None (no checkpointing) when the path is set empty or
+    langgraph-checkpoint-sqlite is not installed.
+    """
+    path = os.environ.get("WORKFLOW_CHECKPOINT_PATH", os.path.join(".cache", "workflow_checkpoints.sqlite"))
+    if not path:
+        return None
+    try:
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    except ImportError:
+        print("langgraph-checkpoint-sqlite is not installed; workflow runs are not checkpointed")
+        return None
+    from utils import run_async
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    class LatestCheckpointSaver(AsyncSqliteSaver):
+        """AsyncSqliteSaver that can prune a thread down to its latest checkpoint."""
+
+        async def aprune(self, thread_ids, *, strategy="keep_latest"):
+            # The workflow has no DeltaChannel state, so the latest checkpoint stands on its own
+            for thread_id in thread_ids:
+                if strategy == "delete":
+                    await self.adelete_thread(thread_id)
+                    continue
+                latest = await self.aget_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+                if latest is None:
+                    continue
+                async with self.lock, self.conn.cursor() as cur:
+                    for table in ("checkpoints", "writes"):
+                        await cur.execute(
+                            f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id != ?",
+                            (str(thread_id), latest.config["configurable"]["checkpoint_id"]),
+                        )
+                    await self.conn.commit()
+
+    async def connect():
+        # The connection belongs to the shared event loop the workflows run on
+        return LatestCheckpointSaver(await aiosqlite.connect(path))
+
+    return run_async(connect())
+
+
+register_backend("openai", create_openai_client)
+register_backend("llm_scheduler", create_llm_scheduler)
+register_backend("workflow_checkpointer", create_workflow_checkpointer)
+register_backend("spacy", "nlp_engine:load_spacy_model")
+register_backend("sentiment", "nlp_engine:load_sentiment_pipeline")
+register_backend("keyword_index", "keyword_index:get_keyword_index")
+register_backend("topic_classifier", "topic_classifier:get_topic_classifier")
+register_backend("storage", "google.cloud.storage:Client")
+register_backend("bigquery", "google.cloud.bigquery:Client")
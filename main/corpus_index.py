@@ -0,0 +1,285 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from utils import stable_document_id
+
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "corpus_index.sqlite")
+
+# MinHash signature length and LSH banding. 16 bands of 8 rows make a pair
+# a candidate with high probability once its Jaccard similarity passes ~0.7
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+
+# Words per shingle
+SHINGLE_SIZE = 5
+
+# Estimated Jaccard similarity from which two texts count as the same paper
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", 0.8))
+
+# Fixed so that signatures written by any process are comparable
+_PERMUTATION_SEED = 1
+
+
+def normalize_url(url):
+    """Lowercase the scheme and host and drop the fragment, so trivially different links match."""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+@functools.lru_cache(maxsize=None)
+def _permutations():
+    import numpy as np
+
+    rng = np.random.default_rng(_PERMUTATION_SEED)
+    # Multiply-shift hashing: odd 64-bit multipliers, keeping the top 32 bits
+    a = rng.integers(1, 2 ** 63, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=(NUM_PERMUTATIONS, 1), dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(text):
+    """
+    Return the MinHash signature of a text's word shingles, or None if it has no words.
+
+    Case, punctuation and line breaks are ignored, so the same paper
+    extracted from two different PDF renderings gets close signatures.
+    """
+    import numpy as np
+
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+         for shingle in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    a, b = _permutations()
+    with np.errstate(over="ignore"):
+        return ((a * hashes + b) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+
+def _band_buckets(signature):
+    """One bucket key per LSH band, as signed 64-bit integers SQLite can store."""
+    return [
+        (band, int.from_bytes(hashlib.blake2b(
+            signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes(), digest_size=8
+        ).digest(), "little", signed=True))
+        for band in range(BANDS)
+    ]
+
+
+class CorpusIndex:
+    """
+    SQLite index of the documents already in the corpus.
+
+    Maps source URLs, exact content hashes (of the PDF file and of its
+    extracted text) and MinHash near-duplicate signatures to one canonical
+    document ID, so a paper found again at another rank, under a mirror
+    URL or as a slightly different rendering is not downloaded or
+    processed twice. Near-duplicates are found through LSH bands stored
+    under a primary key, so a lookup is a handful of index probes however
+    large the corpus grows.
+
+    URLs are recorded as soon as they are downloaded; documents are added
+    once they have been processed, together with the workflow tasks run
+    on them.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " document_id TEXT PRIMARY KEY,"
+            " path TEXT,"
+            " signature BLOB,"
+            " tasks TEXT NOT NULL,"
+            " created_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS urls ("
+            " url TEXT PRIMARY KEY,"
+            " path TEXT,"
+            " document_id TEXT) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " hash TEXT PRIMARY KEY,"
+            " document_id TEXT NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS bands ("
+            " band INTEGER NOT NULL,"
+            " bucket INTEGER NOT NULL,"
+            " document_id TEXT NOT NULL,"
+            " PRIMARY KEY (band, bucket, document_id)) WITHOUT ROWID;"
+        )
+        self._conn.commit()
+
+    def lookup_url(self, url):
+        """
+        Return `{"path", "document_id"}` for a URL seen before, or None.
+
+        `document_id` is None while the download has not been processed.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, document_id FROM urls WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        return {"path": row[0], "document_id": row[1]} if row else None
+
+    def record_download(self, url, path):
+        """Remember where a URL was saved, so it is not downloaded again."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO urls (url, path) VALUES (?, ?)"
+                " ON CONFLICT (url) DO UPDATE SET path = excluded.path",
+                (normalize_url(url), path),
+            )
+            self._conn.commit()
+
+    def lookup_hash(self, *hashes):
+        """Return the document ID of the first of `hashes` (file or text SHA-256) in the index, or None."""
+        with self._lock:
+            for value in hashes:
+                if value:
+                    row = self._conn.execute("SELECT document_id FROM hashes WHERE hash = ?", (value,)).fetchone()
+                    if row:
+                        return row[0]
+        return None
+
+    def find_near_duplicate(self, text, signature=None):
+        """
+        Return `(document_id, similarity)` for the indexed document most similar
+        to `text`, if its estimated Jaccard similarity reaches the threshold.
+        """
+        import numpy as np
+
+        signature = minhash_signature(text) if signature is None else signature
+        if signature is None:
+            return None
+        with self._lock:
+            candidates = set()
+            for band, bucket in _band_buckets(signature):
+                candidates.update(row[0] for row in self._conn.execute(
+                    "SELECT document_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)
+                ))
+            signatures = [
+                self._conn.execute("SELECT document_id, signature FROM documents WHERE document_id = ?",
+                                   (candidate,)).fetchone()
+                for candidate in candidates
+            ]
+
+        best = None
+        for document_id, blob in filter(None, signatures):
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (document_id, similarity)
+        return best
+
+    def covers(self, document_id, tasks):
+        """Whether `document_id` was processed with every one of `tasks`."""
+        with self._lock:
+            row = self._conn.execute("SELECT tasks FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+        return row is not None and set(tasks) <= set(json.loads(row[0]))
+
+    def resolve(self, url=None, sha256=None, text=None):
+        """
+        Return the canonical document a URL, file hash or text belongs to, or None.
+
+        The cheapest checks run first: the URL, then the exact hashes, then
+        the near-duplicate search. A match is returned as
+        `{"document_id", "match", "similarity"}`, where `match` names the
+        check that found it.
+        """
+        match = None
+        if url:
+            entry = self.lookup_url(url)
+            if entry and entry["document_id"]:
+                match = {"document_id": entry["document_id"], "match": "url", "similarity": 1.0}
+        if match is None and (sha256 or text):
+            document_id = self.lookup_hash(sha256, stable_document_id(text) if text else None)
+            if document_id:
+                match = {"document_id": document_id, "match": "hash", "similarity": 1.0}
+        if match is None and text:
+            near_duplicate = self.find_near_duplicate(text)
+            if near_duplicate:
+                match = {"document_id": near_duplicate[0], "match": "near_duplicate",
+                         "similarity": near_duplicate[1]}
+        return match
+
+    def add(self, document_id, text=None, sha256=None, url=None, path=None, tasks=None):
+        """
+        Index a processed document under its URL, hashes and near-duplicate signature.
+
+        `tasks` are added to the workflow tasks the document was processed
+        with before.
+        """
+        signature = minhash_signature(text) if text else None
+        hashes = [value for value in (sha256, stable_document_id(text) if text else None) if value]
+        with self._lock:
+            row = self._conn.execute("SELECT tasks FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO documents (document_id, path, signature, tasks, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, path, signature.tobytes() if signature is not None else None,
+                     json.dumps(sorted(tasks or [])), time.time()),
+                )
+            elif tasks:
+                self._conn.execute(
+                    "UPDATE documents SET tasks = ? WHERE document_id = ?",
+                    (json.dumps(sorted(set(tasks) | set(json.loads(row[0])))), document_id),
+                )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO hashes (hash, document_id) VALUES (?, ?)",
+                [(value, document_id) for value in hashes],
+            )
+            if url:
+                self._conn.execute(
+                    "INSERT INTO urls (url, path, document_id) VALUES (?, ?, ?)"
+                    " ON CONFLICT (url) DO UPDATE SET path = COALESCE(excluded.path, path),"
+                    " document_id = excluded.document_id",
+                    (normalize_url(url), path, document_id),
+                )
+            if signature is not None:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO bands (band, bucket, document_id) VALUES (?, ?, ?)",
+                    [(band, bucket, document_id) for band, bucket in _band_buckets(signature)],
+                )
+            self._conn.commit()
+        return document_id
+
+    def stats(self):
+        """Return the number of documents, URLs and hashes in the index."""
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("documents", "urls", "hashes")
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_corpus_index():
+    """Return the process-wide index, opened at `CORPUS_INDEX_PATH` on first use."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = CorpusIndex(os.environ.get("CORPUS_INDEX_PATH", DEFAULT_INDEX_PATH))
+    return _default_index
@@ -1,46 +1,181 @@
 import os
+import random
+import shutil
+import threading
+import time
 import requests
-from bs4 import BeautifulSoup
 import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from corpus_index import get_corpus_index
+from scholar_search import get_scholar_search
+from telemetry import count, span
+
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# HTTP statuses that signal a transient failure worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
 def search_google_scholar(query, num_results=5):
     """
     Search Google Scholar and return a list of PDF links.
+
+    Follows result pages until `num_results` links are found; pages are
+    cached on disk (see scholar_search).
     """
-    search_url = f"https://scholar.google.com/scholar?q={query}"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(search_url, headers=headers)
-    soup = BeautifulSoup(response.text, "html.parser")
-    links = []
-
-    for result in soup.select(".gs_or_ggsm a"):
-        href = result.get("href")
-        if href and href.endswith(".pdf"):  # Ensure the link ends with ".pdf"
-            links.append(href)
-        if len(links) >= num_results:
-            break
+    links = get_scholar_search().search(query, num_results)
 
     # Log the extracted links for debugging
     print(f"Extracted links: {links}")
     return links
 
 
+class _RetryableDownloadError(Exception):
+    """Raised for transient HTTP failures that are worth retrying."""
+
+
+class PDFDownloader:
+    """
+    Download PDFs concurrently over one pooled HTTP session.
+
+    Responses are streamed to a `.part` file in chunks and renamed into
+    place once complete, so memory use stays flat and an interrupted
+    download resumes from where it stopped via a Range request. Transient
+    failures are retried with exponential backoff, and at most
+    `per_host_limit` downloads run against the same host at a time.
+    """
+
+    def __init__(self, max_workers=8, per_host_limit=2, timeout=(10, 60), max_retries=3,
+                 backoff=0.5, chunk_size=64 * 1024, session=None):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(HEADERS)
+
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def download(self, url, save_path):
+        """
+        Download `url` to `save_path`, returning True on success.
+        """
+        part_path = save_path + ".part"
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._host_semaphore(url), span("download", url=url, attempt=attempt):
+                    return self._fetch(url, save_path, part_path)
+            except (_RetryableDownloadError, requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_retries:
+                    print(f"Failed to download {url} after {attempt + 1} attempts: {e}")
+                    return False
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                print(f"Retrying {url} in {delay:.1f}s ({e})")
+                time.sleep(delay)
+        return False
+
+    def _fetch(self, url, save_path, part_path):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # The partial file already holds every byte, or it is stale
+                content_range = response.headers.get("Content-Range", "")
+                if content_range == f"bytes */{offset}":
+                    os.replace(part_path, save_path)
+                    return True
+                os.remove(part_path)
+                raise _RetryableDownloadError("stale partial download discarded")
+            if response.status_code in RETRY_STATUSES:
+                raise _RetryableDownloadError(f"HTTP {response.status_code}")
+            if response.status_code not in (200, 206):
+                print(f"Failed to download {url}: HTTP {response.status_code}")
+                return False
+
+            # A 200 means the server ignored the Range header, so start over
+            mode = "ab" if response.status_code == 206 else "wb"
+            expected = response.headers.get("Content-Length")
+            written = 0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+            count("pipeline_download_bytes_total", written)
+
+        if expected is not None and written < int(expected):
+            raise _RetryableDownloadError(f"connection closed after {written} of {expected} bytes")
+
+        os.replace(part_path, save_path)
+        return True
+
+    def download_many(self, downloads):
+        """
+        Download `(url, save_path)` pairs concurrently.
+
+        Returns a dict mapping each URL to True if its file was saved.
+        """
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, url, path): url for url, path in downloads}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = future.result()
+                except Exception as e:
+                    print(f"Error downloading {url}: {e}")
+                    results[url] = False
+        return results
+
+
+_default_downloader = None
+_default_downloader_lock = threading.Lock()
+
+
+def get_downloader():
+    """Return the process-wide downloader, sharing one connection pool."""
+    global _default_downloader
+    with _default_downloader_lock:
+        if _default_downloader is None:
+            _default_downloader = PDFDownloader()
+    return _default_downloader
+
 
 def download_pdf(url, save_path):
     """
     Download a PDF file from a given URL and save it locally.
     """
-    headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(url, headers=headers, stream=True)
+    return get_downloader().download(url, save_path)
+
+
+def link_file(source, destination):
+    """Hard-link `source` to `destination`, copying it when the two cannot share an inode."""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:  # Another filesystem, or links not supported
+        shutil.copy2(source, destination)
 
-    if response.status_code == 200:
-        with open(save_path, "wb") as f:
-            f.write(response.content)
-        return True
-    else:
-        print(f"Failed to download {url}: HTTP {response.status_code}")
-        return False
 
 def download_papers_from_google_scholar(query, base_folder, num_results=5):
     """
@@ -59,30 +194,36 @@ def download_papers_from_google_scholar(query, base_folder, num_results=5):
     # Log the extracted links
     print(f"Found {len(pdf_links)} PDF links: {pdf_links}")
 
-    # Download the PDFs
+    index = get_corpus_index()
     downloaded_count = 0
-    for i, pdf_url in enumerate(pdf_links, start=1):
-        try:
-            # Create a unique file name based on the URL
-            file_hash = hashlib.md5(pdf_url.encode()).hexdigest()
-            file_name = f"paper_{i}_{file_hash}.pdf"
-            save_path = os.path.join(topic_folder, file_name)
-
-            # Skip if the file already exists
-            if os.path.exists(save_path):
-                print(f"File already exists: {file_name}")
-                downloaded_count += 1
-                continue
-
-            print(f"Downloading PDF {i}: {pdf_url}")
-            if download_pdf(pdf_url, save_path):
-                print(f"Saved PDF {i} to {save_path}")
-                downloaded_count += 1
-            else:
-                print(f"Failed to download: {pdf_url}")
-
-        except Exception as e:
-            print(f"Error downloading PDF {i}: {pdf_url}")
-            print(f"Exception: {e}")
+    pending = []
+    for pdf_url in dict.fromkeys(pdf_links):
+        # Name files by URL alone, so the same link at another rank maps to the same file
+        file_hash = hashlib.md5(pdf_url.encode()).hexdigest()
+        file_name = f"paper_{file_hash}.pdf"
+        save_path = os.path.join(topic_folder, file_name)
+
+        # Links already downloaded, here or for another topic, are not fetched
+        # again; a file saved for another topic is linked into this one
+        known = index.lookup_url(pdf_url) or {}
+        if known.get("document_id"):
+            print(f"Already in corpus as {known['document_id'][:12]}: {pdf_url}")
+        existing = save_path if os.path.exists(save_path) else known.get("path")
+        if existing and os.path.exists(existing):
+            link_file(existing, save_path)
+            print(f"File already exists: {existing}")
+            downloaded_count += 1
+            continue
+        pending.append((pdf_url, save_path))
+
+    # Download the remaining PDFs concurrently
+    results = get_downloader().download_many(pending)
+    for pdf_url, save_path in pending:
+        if results.get(pdf_url):
+            index.record_download(pdf_url, save_path)
+            print(f"Saved {pdf_url} to {save_path}")
+            downloaded_count += 1
+        else:
+            print(f"Failed to download: {pdf_url}")
 
     return downloaded_count  # Return the count of successfully downloaded PDFs
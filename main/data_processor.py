@@ -1,24 +1,185 @@
 import os
+import hashlib
+import json
 import fitz  # PyMuPDF
 from random import sample
-from sklearn.feature_extraction.text import TfidfVectorizer
-import spacy
-from transformers import pipeline
-from sklearn.feature_extraction.text import TfidfVectorizer
-import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from backends import get_backend
+from corpus_index import get_corpus_index
+from telemetry import count, span
+from utils import stable_document_id
+
+
+# Bump whenever extraction output changes so cached text is not reused
+EXTRACTOR_VERSION = "pymupdf-text-1"
+DEFAULT_EXTRACTION_CACHE_DIR = os.path.join(".cache", "extracted")
+
+
+def open_pdf(source):
+    """Open a PDF from a file path or from its bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """Open a PDF once and return its page count and the text of pages [start, stop)."""
+    with open_pdf(pdf_path) as pdf:
+        stop = min(stop, pdf.page_count)
+        return pdf.page_count, "".join(pdf[page_num].get_text() for page_num in range(start, stop))
+
 
 def extract_text_from_pdf(pdf_path, max_pages=10):
     """Extract text from the first `max_pages` pages of a PDF."""
     text = ""
-    try:
-        with fitz.open(pdf_path) as pdf:
-            for page_num in range(min(max_pages, len(pdf))):
-                text += pdf[page_num].get_text()
-    except Exception as e:
-        print(f"Error extracting text from {pdf_path}: {e}")
+    with span("extraction", files=1) as attributes:
+        try:
+            page_count, text = _extract_page_range(pdf_path, 0, max_pages)
+            attributes["pages"] = min(page_count, max_pages)
+            count("pipeline_pages_extracted_total", attributes["pages"])
+        except Exception as e:
+            print(f"Error extracting text from {pdf_path}: {e}")
     return text
 
 
+def file_sha256(path, block_size=1024 * 1024):
+    """Return the hex SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted text keyed by file content hash, page range
+    and extractor version, so renamed or re-downloaded copies still hit.
+    """
+
+    def __init__(self, directory=DEFAULT_EXTRACTION_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, content_hash, max_pages):
+        key = hashlib.sha256(f"{content_hash}:0-{max_pages}:{EXTRACTOR_VERSION}".encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, content_hash, max_pages):
+        """Return the cached `{"page_count", "text"}` entry, or None."""
+        try:
+            with open(self._path(content_hash, max_pages), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, content_hash, max_pages, page_count, text):
+        path = self._path(content_hash, max_pages)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"page_count": page_count, "text": text}, f)
+        os.replace(tmp_path, path)
+
+
+def extract_pdfs(pdf_paths, max_pages=10, max_workers=None, pages_per_task=8, cache=None):
+    """
+    Extract text from many PDFs in parallel over a process pool.
+
+    Each task opens a file once and extracts a range of `pages_per_task`
+    pages; the first range of every file is scheduled up front and the rest
+    of a large file is fanned out once its page count is known. Results are
+    cached by content hash, so files seen before are never reopened.
+
+    Returns one dict per input path, in order, with the keys `path`,
+    `sha256`, `page_count` and `text`. Files that could not be opened have
+    a `page_count` of 0 and an `error`.
+    """
+    with span("extraction", files=len(pdf_paths)) as attributes:
+        results = _extract_pdfs(pdf_paths, max_pages, max_workers, pages_per_task, cache)
+        attributes["pages"] = sum(min(result["page_count"], max_pages) for result in results)
+    count("pipeline_pages_extracted_total", attributes["pages"])
+    return results
+
+
+def _extract_pdfs(pdf_paths, max_pages, max_workers, pages_per_task, cache):
+    cache = cache if cache is not None else ExtractionCache()
+    results = []
+    pending = {}
+    for path in pdf_paths:
+        result = {"path": path, "sha256": None, "page_count": 0, "text": ""}
+        results.append(result)
+        try:
+            result["sha256"] = file_sha256(path)
+        except OSError as e:
+            result["error"] = str(e)
+            continue
+        cached = cache.get(result["sha256"], max_pages)
+        count("pipeline_cache_requests_total", cache="extraction", result="miss" if cached is None else "hit")
+        if cached is not None:
+            result.update(cached)
+        else:
+            pending[len(results) - 1] = {}
+
+    if not pending:
+        return results
+
+    def finish(index):
+        result = results[index]
+        chunks = pending.pop(index)
+        result["text"] = "".join(chunks[start] for start in sorted(chunks))
+        cache.set(result["sha256"], max_pages, result["page_count"], result["text"])
+
+    first_stop = min(pages_per_task, max_pages)
+    if len(pending) == 1 and max_pages <= pages_per_task:
+        # Not worth starting a pool for a single small task
+        index = next(iter(pending))
+        try:
+            results[index]["page_count"], pending[index][0] = _extract_page_range(
+                results[index]["path"], 0, first_stop
+            )
+            finish(index)
+        except Exception as e:
+            print(f"Invalid PDF: {results[index]['path']}, Error: {e}")
+            results[index]["error"] = str(e)
+        return results
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_extract_page_range, results[index]["path"], 0, first_stop): (index, 0)
+            for index in pending
+        }
+        remaining = {index: 1 for index in pending}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, start = futures.pop(future)
+                result = results[index]
+                if index not in pending:
+                    continue  # An earlier range of this file failed
+                try:
+                    page_count, text = future.result()
+                except Exception as e:
+                    print(f"Invalid PDF: {result['path']}, Error: {e}")
+                    result["error"] = str(e)
+                    result["page_count"] = 0
+                    pending.pop(index)
+                    continue
+
+                pending[index][start] = text
+                remaining[index] -= 1
+                if start == 0:
+                    result["page_count"] = page_count
+                    for next_start in range(first_stop, min(max_pages, page_count), pages_per_task):
+                        stop = min(next_start + pages_per_task, max_pages)
+                        future = executor.submit(_extract_page_range, result["path"], next_start, stop)
+                        futures[future] = (index, next_start)
+                        remaining[index] += 1
+                if remaining[index] == 0:
+                    finish(index)
+
+    return results
+
+
 def get_random_pdf_paths(folder_path, num_files):
     """Return a list of random PDF file paths from the given folder."""
     pdf_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith('.pdf')]
@@ -29,61 +190,95 @@ def get_random_pdf_paths(folder_path, num_files):
 
 def is_valid_pdf(file_path):
     """Check if the file is a valid PDF."""
-    try:
-        with fitz.open(file_path) as pdf:
-            return pdf.page_count > 0  # Ensure the PDF has at least one page
-    except Exception as e:
-        print(f"Invalid PDF: {file_path}, Error: {e}")
-        return False
+    with span("validation", kind="pdf"):
+        try:
+            with fitz.open(file_path) as pdf:
+                return pdf.page_count > 0  # Ensure the PDF has at least one page
+        except Exception as e:
+            print(f"Invalid PDF: {file_path}, Error: {e}")
+            return False
 
 
-def process_pdfs(base_folder, topic, max_pages=10, num_files=1):
+def load_pdf_documents(base_folder, topic, max_pages=10, num_files=1, index=None):
     """
-    Process multiple PDFs by extracting text.
+    Extract up to `num_files` valid PDFs from a topic folder.
+
+    Returns the document dicts produced by `extract_pdfs`. With a corpus
+    `index`, documents it already holds (the same file, the same text or a
+    near-duplicate) are skipped without counting towards `num_files`.
     """
     topic_folder = os.path.join(base_folder, topic.replace(" ", "_"))
     if not os.path.exists(topic_folder) or not os.listdir(topic_folder):
         raise FileNotFoundError(f"No PDF files found in folder: {topic_folder}")
 
-    pdf_paths = [
-        f for f in os.listdir(topic_folder) if f.endswith(".pdf") and is_valid_pdf(os.path.join(topic_folder, f))
-    ]
-    if not pdf_paths:
+    candidates = sorted(f for f in os.listdir(topic_folder) if f.endswith(".pdf"))
+
+    # Extract the first `num_files` files, topping up from the remaining
+    # candidates when some of them turn out not to be valid PDFs or to be
+    # in the index already
+    processed = []
+    indexed = 0
+    while candidates and len(processed) < num_files:
+        needed = num_files - len(processed)
+        batch, candidates = candidates[:needed], candidates[needed:]
+        documents = extract_pdfs([os.path.join(topic_folder, f) for f in batch], max_pages=max_pages)
+        for pdf_path, document in zip(batch, documents):
+            if document["page_count"] <= 0:
+                continue
+            duplicate = index.resolve(sha256=document["sha256"], text=document["text"]) if index else None
+            if duplicate:
+                indexed += 1
+                print(f"Already in corpus as {duplicate['document_id'][:12]} ({duplicate['match']}): {pdf_path}")
+            else:
+                processed.append(document)
+                print(f"Processed: {pdf_path}")
+
+    if not processed and not indexed:
         raise FileNotFoundError(f"No valid PDF files found in folder: {topic_folder}")
 
-    # Select random PDFs to process
-    pdf_paths = pdf_paths[:num_files]
-    processed_texts = []
-    for pdf_path in pdf_paths:
-        try:
-            text = extract_text_from_pdf(os.path.join(topic_folder, pdf_path), max_pages=max_pages)
-            processed_texts.append(text)
-            print(f"Processed: {pdf_path}")
-        except Exception as e:
-            print(f"Error processing {pdf_path}: {e}")
+    return processed
+
 
-    return processed_texts
+def process_pdfs(base_folder, topic, max_pages=10, num_files=1):
+    """
+    Process multiple PDFs by extracting text, skipping papers already in the corpus index.
+    """
+    documents = load_pdf_documents(base_folder, topic, max_pages=max_pages, num_files=num_files,
+                                   index=get_corpus_index())
+    return [document["text"] for document in documents]
 
 
 def extract_keywords(text, top_n=5):
     """
     Extract the top_n keywords from the text using TF-IDF.
+
+    IDF comes from the persistent corpus keyword index, which the text is
+    added to once, under its stable document ID.
     """
-    vectorizer = TfidfVectorizer(stop_words="english", max_features=top_n)
-    tfidf_matrix = vectorizer.fit_transform([text])
-    keywords = vectorizer.get_feature_names_out()
-    return list(keywords)
+    return get_backend("keyword_index").keywords([text], top_n=top_n, doc_ids=[stable_document_id(text)])[0]
+
+
+def extract_keywords_batch(texts, top_n=5, doc_ids=None):
+    """
+    Extract the top_n keywords of many texts in one pass over the corpus index.
+
+    Texts whose ID (by default their stable document ID) is already indexed
+    are scored without being counted again.
+    """
+    if doc_ids is None:
+        doc_ids = [stable_document_id(text) for text in texts]
+    return get_backend("keyword_index").keywords(texts, top_n=top_n, doc_ids=doc_ids)
 
 
 def classify_topic(text):
     """
     Classify the topic based on specific keywords or phrases.
     """
-    if "machine learning" in text.lower() or "ai" in text.lower():
-        return "Artificial Intelligence"
-    elif "finance" in text.lower() or "economy" in text.lower():
-        return "Finance"
-    elif "biology" in text.lower() or "health" in text.lower():
-        return "Biology/Health"
-    else:
-        return "General"
+    return get_backend("topic_classifier").classify(text)
+
+
+def classify_topics(texts):
+    """
+    Classify the topic of many texts.
+    """
+    return get_backend("topic_classifier").classify_batch(texts)
@@ -1,21 +1,351 @@
-from google.cloud import storage, bigquery
+import atexit
+import base64
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from backends import get_backend
+from telemetry import span
+
+try:
+    import google_crc32c
+except ImportError:  # Shipped with google-cloud-storage, but only needed for composite blobs
+    google_crc32c = None
+
+
+def _file_checksums(path, block_size=1024 * 1024):
+    """Return the base64 MD5 and CRC32C of a file, as GCS reports them, in one read pass."""
+    md5 = hashlib.md5()
+    crc = google_crc32c.Checksum() if google_crc32c is not None else None
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+            if crc is not None:
+                crc.update(block)
+    md5_b64 = base64.b64encode(md5.digest()).decode("ascii")
+    crc_b64 = base64.b64encode(crc.digest()).decode("ascii") if crc is not None else None
+    return md5_b64, crc_b64
+
+
+class GCSBulkUploader:
+    """
+    Upload many files to one bucket in parallel over a shared client.
+
+    Files whose MD5 (or CRC32C, for composite objects) already matches the
+    remote blob are skipped. Files of at least `resumable_threshold` bytes
+    are sent as chunked resumable uploads. Pass `client` to use a fake
+    backend; the default client honours STORAGE_EMULATOR_HOST.
+    """
+
+    def __init__(self, bucket_name, client=None, max_workers=8, chunk_size=8 * 1024 * 1024,
+                 resumable_threshold=8 * 1024 * 1024):
+        self.client = client or get_backend("storage")
+        self.bucket = self.client.bucket(bucket_name)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.resumable_threshold = resumable_threshold
+
+    def upload_file(self, source_file_name, destination_blob_name):
+        """
+        Upload one file unless an identical blob exists.
+
+        Returns a dict with the blob name, status ("uploaded", "skipped" or
+        "failed"), size in bytes and elapsed seconds.
+        """
+        start = time.perf_counter()
+        result = {
+            "source": source_file_name,
+            "blob": destination_blob_name,
+            "bytes": os.path.getsize(source_file_name),
+        }
+        with span("storage.upload", blob=destination_blob_name, bytes=result["bytes"]) as attributes:
+            try:
+                md5_b64, crc_b64 = _file_checksums(source_file_name)
+                remote = self.bucket.get_blob(destination_blob_name)
+                if remote is not None and (
+                    (remote.md5_hash and remote.md5_hash == md5_b64)
+                    or (not remote.md5_hash and crc_b64 and remote.crc32c == crc_b64)
+                ):
+                    result["status"] = "skipped"
+                else:
+                    chunk_size = self.chunk_size if result["bytes"] >= self.resumable_threshold else None
+                    blob = self.bucket.blob(destination_blob_name, chunk_size=chunk_size)
+                    # Let GCS verify the content against the local digest
+                    blob.md5_hash = md5_b64
+                    content_type = "application/pdf" if source_file_name.endswith(".pdf") else None
+                    blob.upload_from_filename(source_file_name, content_type=content_type)
+                    result["status"] = "uploaded"
+            except Exception as e:
+                print(f"Error uploading {source_file_name}: {e}")
+                result["status"] = "failed"
+                result["error"] = str(e)
+            attributes["status"] = result["status"]
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    def upload_many(self, uploads):
+        """Upload `(source_file_name, destination_blob_name)` pairs in parallel."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda pair: self.upload_file(*pair), uploads))
+
+    def upload_directory(self, folder, prefix="", suffix=".pdf"):
+        """
+        Upload every file under `folder` ending in `suffix`, keeping relative paths.
+
+        Blob names are `prefix` joined with the path relative to `folder`.
+        """
+        uploads = []
+        for root, _, files in os.walk(folder):
+            for name in sorted(files):
+                if name.endswith(suffix):
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, folder).replace(os.sep, "/")
+                    uploads.append((path, f"{prefix.rstrip('/')}/{relative}" if prefix else relative))
+
+        results = self.upload_many(uploads)
+        for result in results:
+            print(f"{result['status']:>8} {result['blob']} ({result['bytes']} bytes, {result['seconds']:.2f}s)")
+        return results
 
 
 def upload_to_gcs(bucket_name, source_file_name, destination_blob_name):
     """Upload file to Google Cloud Storage."""
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(source_file_name)
-    print(f"File {source_file_name} uploaded to {destination_blob_name}.")
+    result = GCSBulkUploader(bucket_name).upload_file(source_file_name, destination_blob_name)
+    if result["status"] == "skipped":
+        print(f"File {source_file_name} already matches {destination_blob_name}.")
+    elif result["status"] == "uploaded":
+        print(f"File {source_file_name} uploaded to {destination_blob_name}.")
+    return result
+
+
+# Insert error reasons worth resending: rows stopped only because another row
+# in the request was invalid, and transient backend failures
+RETRYABLE_INSERT_REASONS = {"stopped", "backendError", "internalError", "timeout", "rateLimitExceeded"}
+
+
+class BufferedSink:
+    """
+    Buffer rows in memory and write them out in batches.
+
+    The buffer is flushed when it holds `max_rows` rows or `max_bytes` of
+    serialized JSON, or when the oldest buffered row is `max_interval`
+    seconds old. Subclasses implement `_write(rows)`.
+    """
+
+    def __init__(self, max_rows=500, max_bytes=5 * 1024 * 1024, max_interval=10.0):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval
+
+        self._rows = []
+        self._bytes = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def add(self, row):
+        """Buffer a row, flushing if a size threshold is reached."""
+        row = dict(row)
+        row.setdefault("created_at", datetime.utcnow().isoformat())
+        size = len(json.dumps(row, default=str))
+        with self._lock:
+            self._rows.append(row)
+            self._bytes += size
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._rows) >= self.max_rows or self._bytes >= self.max_bytes
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write every buffered row.
+
+        If the write fails, the rows go back into the buffer and are
+        written by a later flush.
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            size, self._bytes = self._bytes, 0
+            oldest, self._oldest = self._oldest, None
+        if not rows:
+            return
+        try:
+            with self._write_lock, span("storage.flush", sink=type(self).__name__, rows=len(rows)):
+                self._write(rows)
+        except Exception as e:
+            print(f"Error writing {len(rows)} buffered rows, keeping them for the next flush: {e}")
+            with self._lock:
+                self._rows[:0] = rows
+                self._bytes += size
+                self._oldest = oldest if self._oldest is None else min(oldest, self._oldest)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(min(1.0, self.max_interval)):
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_interval
+            if due:
+                self.flush()
+
+    def _write(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        """Stop the background flusher and write any remaining rows."""
+        self._closed.set()
+        self.flush()
+        if self._rows:
+            print(f"Lost {len(self._rows)} rows that could not be written")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BigQuerySink(BufferedSink):
+    """
+    Batched writer for a BigQuery table over one long-lived client.
+
+    Small batches use streaming inserts; rows BigQuery rejects as invalid
+    are dropped and the rest of a failed request is retried with backoff.
+    Batches of at least `load_job_rows` rows are written with a single
+    NDJSON load job instead.
+    """
+
+    def __init__(self, dataset_id, table_id, client=None, load_job_rows=1000, max_retries=3,
+                 backoff=1.0, **kwargs):
+        self.client = client or get_backend("bigquery")
+        self.table_ref = f"{self.client.project}.{dataset_id}.{table_id}"
+        self.load_job_rows = load_job_rows
+        self.max_retries = max_retries
+        self.backoff = backoff
+        super().__init__(**kwargs)
+
+    def _write(self, rows):
+        if len(rows) >= self.load_job_rows:
+            self._load(rows)
+        else:
+            self._insert(rows)
+
+    def _insert(self, rows):
+        inserted = len(rows)
+        for attempt in range(self.max_retries + 1):
+            errors = self.client.insert_rows_json(self.table_ref, rows)
+            if attempt == self.max_retries and errors:
+                print(f"Error inserting data into BigQuery: {errors}")
+                inserted -= len(errors)
+                break
+            # Drop the rows BigQuery rejected as invalid and resend the ones it only stopped
+            retry = []
+            for error in errors:
+                reasons = {detail.get("reason") for detail in error.get("errors", [])}
+                if reasons <= RETRYABLE_INSERT_REASONS:
+                    retry.append(rows[error["index"]])
+                else:
+                    print(f"Dropping row rejected by BigQuery: {error.get('errors')}")
+                    inserted -= 1
+            if not retry:
+                break
+            rows = retry
+            time.sleep(self.backoff * (2 ** attempt))
+        print(f"Inserted {inserted} rows into BigQuery.")
+
+    def _load(self, rows):
+        from google.cloud import bigquery
+
+        data = "\n".join(json.dumps(row, default=str) for row in rows).encode("utf-8")
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+        job = self.client.load_table_from_file(io.BytesIO(data), self.table_ref, job_config=job_config)
+        job.result()
+        print(f"Loaded {len(rows)} rows into BigQuery.")
+
+
+class SQLiteSink(BufferedSink):
+    """
+    Local stand-in for BigQuerySink that stores rows as JSON in SQLite.
+
+    Pass ":memory:" as `path` for an in-memory table.
+    """
+
+    def __init__(self, dataset_id, table_id, path=":memory:", **kwargs):
+        self.table_name = f"{dataset_id}__{table_id}"
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self.table_name}" (row TEXT NOT NULL)'
+        )
+        self._conn.commit()
+        super().__init__(**kwargs)
+
+    def _write(self, rows):
+        self._conn.executemany(
+            f'INSERT INTO "{self.table_name}" (row) VALUES (?)',
+            [(json.dumps(row, default=str),) for row in rows],
+        )
+        self._conn.commit()
+
+    def rows(self):
+        """Return every stored row."""
+        with self._write_lock:
+            cursor = self._conn.execute(f'SELECT row FROM "{self.table_name}"')
+            return [json.loads(row) for (row,) in cursor]
+
+
+def _default_sink_factory(dataset_id, table_id):
+    path = os.environ.get("PIPELINE_SQLITE_SINK")
+    if path:
+        return SQLiteSink(dataset_id, table_id, path=path)
+    return BigQuerySink(dataset_id, table_id)
+
+
+_sink_factory = _default_sink_factory
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def set_sink_factory(factory):
+    """
+    Replace the factory used to create table sinks, e.g. with SQLiteSink for tests.
+
+    Sinks created by the previous factory are flushed and dropped.
+    """
+    global _sink_factory
+    close_sinks()
+    _sink_factory = factory
+
+
+def get_sink(dataset_id, table_id):
+    """Return the shared sink for a table, creating it on first use."""
+    key = (dataset_id, table_id)
+    with _sinks_lock:
+        if key not in _sinks:
+            _sinks[key] = _sink_factory(dataset_id, table_id)
+        return _sinks[key]
+
+
+@atexit.register
+def close_sinks():
+    """Flush and close every shared sink."""
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
 
 
 def store_in_bigquery(dataset_id, table_id, structured_data):
-    """Store structured data in BigQuery."""
-    client = bigquery.Client()
-    table_ref = f"{client.project}.{dataset_id}.{table_id}"
-    errors = client.insert_rows_json(table_ref, [structured_data])
-    if errors:
-        print(f"Error inserting data into BigQuery: {errors}")
-    else:
-        print("Data successfully inserted into BigQuery.")
+    """Store structured data in BigQuery through the table's buffered sink."""
+    with span("storage", table=f"{dataset_id}.{table_id}"):
+        get_sink(dataset_id, table_id).add(structured_data)
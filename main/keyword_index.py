@@ -0,0 +1,152 @@
+import json
+import math
+import os
+import threading
+import numpy as np
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.utils import murmurhash3_32
+
+
+DEFAULT_INDEX_DIR = os.path.join(".cache", "keyword_index")
+
+
+def _feature_index(term, n_features):
+    """Column FeatureHasher assigns to `term` (mirrors sklearn's hashing)."""
+    h = murmurhash3_32(term, seed=0)
+    if h == -2147483648:
+        return (2147483647 - (n_features - 1)) % n_features
+    return abs(h) % n_features
+
+
+class KeywordIndex:
+    """
+    Corpus-level TF-IDF keyword index over hashed terms.
+
+    Document frequencies are kept per hash bucket, so the vocabulary never
+    grows, in a memory-mapped array on disk that is updated incrementally as
+    documents arrive. Scoring a batch tokenizes each document once and
+    weights the whole batch in one sparse-matrix pass.
+
+    The index is safe to share between threads of one process; concurrent
+    writers in different processes are not supported.
+    """
+
+    def __init__(self, directory=DEFAULT_INDEX_DIR, n_features=2 ** 20, ngram_range=(1, 1)):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._analyzer = CountVectorizer(stop_words="english", ngram_range=ngram_range).build_analyzer()
+
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._df_path = os.path.join(directory, "df.npy")
+        self._ids_path = os.path.join(directory, "documents.txt")
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self.n_features = meta["n_features"]
+            self.n_docs = meta["n_docs"]
+            self.df = np.load(self._df_path, mmap_mode="r+")
+        else:
+            self.n_features = n_features
+            self.n_docs = 0
+            self.df = np.lib.format.open_memmap(self._df_path, mode="w+", dtype=np.uint32, shape=(n_features,))
+            self._write_meta()
+
+        self._hasher = FeatureHasher(n_features=self.n_features, input_type="string", alternate_sign=False)
+        self._doc_ids = set()
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path) as f:
+                self._doc_ids = {line.strip() for line in f if line.strip()}
+
+    def _write_meta(self):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"n_features": self.n_features, "n_docs": self.n_docs}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _vectorize(self, texts):
+        tokens = [self._analyzer(text) for text in texts]
+        return tokens, self._hasher.transform(tokens).tocsr()
+
+    def _update(self, matrix, doc_ids):
+        """Count each row of `matrix` towards the document frequencies."""
+        rows = list(range(matrix.shape[0]))
+        if doc_ids is not None:
+            rows, new_ids = [], []
+            for row, doc_id in enumerate(doc_ids):
+                if doc_id not in self._doc_ids and doc_id not in new_ids:
+                    rows.append(row)
+                    new_ids.append(doc_id)
+        if not rows:
+            return
+        columns = np.concatenate([matrix.indices[matrix.indptr[r]:matrix.indptr[r + 1]] for r in rows])
+        np.add.at(self.df, columns, 1)
+        self.df.flush()
+        self.n_docs += len(rows)
+        self._write_meta()
+        if doc_ids is not None:
+            self._doc_ids.update(new_ids)
+            with open(self._ids_path, "a") as f:
+                f.writelines(f"{doc_id}\n" for doc_id in new_ids)
+
+    def add_documents(self, texts, doc_ids=None):
+        """
+        Add documents to the corpus frequencies.
+
+        Documents whose ID is already in the index are skipped.
+        """
+        with self._lock:
+            _, matrix = self._vectorize(texts)
+            self._update(matrix, doc_ids)
+
+    def keywords(self, texts, top_n=5, update=True, doc_ids=None):
+        """
+        Return the `top_n` keywords of each text, weighted by corpus IDF.
+
+        With `update`, the texts are first added to the corpus frequencies.
+        """
+        with self._lock:
+            tokens, matrix = self._vectorize(texts)
+            if update:
+                self._update(matrix, doc_ids)
+            n_docs = max(self.n_docs, 1)
+
+            # Smooth IDF, as TfidfVectorizer, computed only for non-zero entries
+            df = self.df[matrix.indices].astype(np.float64)
+            matrix.data = matrix.data * (np.log((1 + n_docs) / (1 + df)) + 1)
+
+        results = []
+        for row, doc_tokens in enumerate(tokens):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            if start == end:
+                results.append([])
+                continue
+            data, indices = matrix.data[start:end], matrix.indices[start:end]
+            top = np.argsort(-data, kind="stable")[:top_n]
+
+            # Hashing is one-way, so map the winning columns back through the document's own terms
+            terms = {}
+            for term in doc_tokens:
+                terms.setdefault(_feature_index(term, self.n_features), term)
+            results.append([terms[indices[i]] for i in top if indices[i] in terms])
+        return results
+
+    def idf(self, term):
+        """Return the smoothed IDF of a term in the current corpus."""
+        df = int(self.df[_feature_index(term, self.n_features)])
+        return math.log((1 + max(self.n_docs, 1)) / (1 + df)) + 1
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_keyword_index():
+    """Return the process-wide index, opened at `KEYWORD_INDEX_DIR` on first use."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = KeywordIndex(os.environ.get("KEYWORD_INDEX_DIR", DEFAULT_INDEX_DIR))
+    return _default_index
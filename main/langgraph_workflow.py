@@ -1,74 +1,252 @@
-from langgraph.graph import StateGraph
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import StreamWriter
 from langchain_core.messages import HumanMessage
-from typing import TypedDict, List
-from openai import OpenAI
-import streamlit as st
-
-
-
-# Define the state schema using TypedDict
+from langchain_core.runnables import RunnableConfig
+from typing import Annotated, TypedDict, List
+import asyncio
+import inspect
+import json
+import os
+import queue
+import re
+import threading
+import time
+from backends import get_backend
+from llm_cache import get_llm_cache, make_cache_key
+from llm_scheduler import request_priority
+from openai_batch import BatchQueued, get_offline_batch
+from telemetry import get_telemetry, span
+from text_chunking import chunk_text, count_tokens, truncate_to_tokens
+from nlp_engine import entity_batcher, sentiment_batcher
+from pdf_metadata import LOCAL_METADATA_CONFIDENCE, extract_local_metadata
+from utils import get_event_loop, run_async, stable_document_id, validate_extracted_data
+
+
+def merge_dicts(left, right):
+    """Reducer that merges dict updates written by parallel branches."""
+    return {**(left or {}), **(right or {})}
+
+
+def merge_errors(left, right):
+    """Merge node errors; the None that run_workflow writes at the start of a run clears earlier runs' errors."""
+    if right is None:
+        return {}
+    return merge_dicts(left, right)
+
+
+# Define the state schema using TypedDict.
+# Nodes return only the keys they produce, so branches running in the same
+# step never overwrite each other; dict-valued keys are merged by reducer.
 class StateSchema(TypedDict):
     messages: List[HumanMessage]
     summary: str
-    metadata: dict  
+    metadata: Annotated[dict, merge_dicts]
     sentiment: str
-    entities: dict
+    entities: Annotated[dict, merge_dicts]
+    # Node name -> why it produced no output (timed out, or skipped after a dependency did)
+    errors: Annotated[dict, merge_errors]
 
 
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+async def cached_chat_completion(system_prompt, user_template, content, on_token=None, **params):
+    """
+    Run a chat completion through the persistent LLM response cache.
 
-def summarization_node(state: StateSchema):
-    """Summarize document content using the latest OpenAI API."""
-    content = state["messages"][-1].content
+    `user_template` is formatted with `content`; the cache key covers the
+    prompts, the request parameters and the content, so repeat documents
+    are answered from disk without spending tokens.
+
+    If `on_token` is given, the response is streamed and each text delta is
+    passed to it as it arrives (a cached response is passed in one piece).
 
-    # Call OpenAI GPT to generate a summary
-    response = client.chat.completions.create(
+    Requests go through the shared rate-limit scheduler. In offline batch
+    mode a cache miss is queued for the Batch API and raises BatchQueued.
+
+    Only complete responses are cached: one cut off at `max_tokens` or
+    refused (no content) is returned as is, and requested again next time.
+    """
+    cache = get_llm_cache()
+    telemetry = get_telemetry()
+    model = params.get("model")
+    key = make_cache_key(model, [system_prompt, user_template], params, content)
+    cached = cache.get(key)
+    telemetry.count("pipeline_cache_requests_total", cache="llm", result="miss" if cached is None else "hit")
+    if cached is not None:
+        if on_token is not None:
+            on_token(cached)
+        return cached
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_template.format(content=content)},
+    ]
+    offline_batch = get_offline_batch()
+    if offline_batch is not None:
+        offline_batch.queue(key, {"messages": messages, **params})
+        raise BatchQueued(key)
+
+    scheduler = get_backend("llm_scheduler")
+    with telemetry.span("llm", model=model) as attributes:
+        if on_token is None:
+            response = await scheduler.create(messages=messages, **params)
+            choice = response.choices[0]
+            result = (choice.message.content or "").strip()
+            finish_reason = choice.finish_reason
+            usage = response.usage
+        else:
+            parts = []
+            usage = finish_reason = None
+            stream = await scheduler.create(
+                messages=messages, stream=True, stream_options={"include_usage": True}, **params
+            )
+            async with stream:  # Frees the scheduler slot even if on_token raises
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage  # Sent in a final chunk without choices
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_token(delta)
+            result = "".join(parts).strip()
+
+        if usage is not None:
+            attributes.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+            attributes["cost_usd"] = telemetry.record_llm_usage(model, usage.prompt_tokens, usage.completion_tokens)
+        attributes["finish_reason"] = finish_reason
+
+    if finish_reason == "stop" and result:
+        cache.set(key, result)
+    else:
+        print(f"Not caching incomplete {model} response (finish_reason={finish_reason})")
+    return result
+
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful assistant that summarizes text."
+SUMMARY_USER_PROMPT = "Summarize the following text:\n\n{content}"
+CHUNK_SUMMARY_USER_PROMPT = (
+    "Summarize this excerpt from a research paper. Keep its key findings, methods "
+    "and any figures it reports:\n\n{content}"
+)
+REDUCE_SUMMARY_USER_PROMPT = (
+    "The following are summaries of consecutive parts of one research paper. "
+    "Combine them into a single summary of the whole paper:\n\n{content}"
+)
+
+# Map-reduce summarization settings; each can be overridden per run through
+# config["configurable"] (e.g. {"summary_chunk_tokens": 2000}).
+SUMMARY_SETTINGS = {
+    # Documents up to this many tokens are summarized in a single call
+    "summary_single_pass_tokens": 6000,
+    "summary_chunk_tokens": 3000,
+    "summary_chunk_overlap": 200,
+    "summary_concurrency": 4,
+    "summary_chunk_max_tokens": 200,
+}
+
+# Metadata sits on the first page, so only the start of a document is sent
+METADATA_INPUT_TOKENS = 3000
+
+
+def _settings(config, defaults):
+    configurable = (config or {}).get("configurable", {})
+    return {key: configurable.get(key, value) for key, value in defaults.items()}
+
+
+async def _summarize(content, max_tokens=300, user_template=SUMMARY_USER_PROMPT, on_token=None):
+    return await cached_chat_completion(
+        SUMMARY_SYSTEM_PROMPT,
+        user_template,
+        content,
+        on_token=on_token,
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that summarizes text."},
-            {"role": "user", "content": f"Summarize the following text:\n\n{content}"}
-        ],
         temperature=0.7,
-        max_tokens=300,  # Adjust this to control the length of the summary
-        n=1,             # Generate a single summary
-        stop=None        # Allow the summary to stop naturally
+        max_tokens=max_tokens,  # Adjust this to control the length of the summary
+        n=1,                    # Generate a single summary
+        stop=None               # Allow the summary to stop naturally
     )
 
-    summary = response.choices[0].message.content.strip()
-    state["summary"] = summary
 
-    return state
+async def condense_chunks(content, settings):
+    """
+    Summarize token-budgeted chunks of a long document concurrently and
+    return the joined chunk summaries.
 
-import re
+    If the joined summaries are still too long for one call, they are
+    chunked and summarized again.
+    """
+    semaphore = asyncio.Semaphore(settings["summary_concurrency"])
 
-def metadata_extraction_node(state: StateSchema):
-    """Extract metadata (title, authors, publication date, abstract) using OpenAI API."""
+    async def summarize_chunk(chunk):
+        async with semaphore:
+            return await _summarize(
+                chunk, settings["summary_chunk_max_tokens"], CHUNK_SUMMARY_USER_PROMPT
+            )
+
+    text = content
+    while True:
+        chunks = chunk_text(text, settings["summary_chunk_tokens"], settings["summary_chunk_overlap"])
+        partial_summaries = await asyncio.gather(*(summarize_chunk(chunk) for chunk in chunks))
+        text = "\n\n".join(partial_summaries)
+        if len(chunks) == 1 or count_tokens(text) <= settings["summary_single_pass_tokens"]:
+            return text
+
+
+async def map_reduce_summary(content, settings, on_token=None):
+    """Summarize a long document by combining its concurrently summarized chunks."""
+    condensed = await condense_chunks(content, settings)
+    return await _summarize(condensed, user_template=REDUCE_SUMMARY_USER_PROMPT, on_token=on_token)
+
+
+async def summarization_node(state: StateSchema, config: RunnableConfig = None, writer: StreamWriter = None):
+    """
+    Summarize document content using the latest OpenAI API.
+
+    With `config["configurable"]["stream_summary"]` set, the final summary
+    is streamed as `{"summary_token": ...}` custom stream events.
+    """
     content = state["messages"][-1].content
+    settings = _settings(config, SUMMARY_SETTINGS)
+    on_token = None
+    if writer is not None and _settings(config, {"stream_summary": False})["stream_summary"]:
+        on_token = lambda token: writer({"summary_token": token})
+
+    # Call OpenAI GPT to generate a summary, splitting long documents
+    if count_tokens(content) <= settings["summary_single_pass_tokens"]:
+        summary = await _summarize(content, on_token=on_token)
+    else:
+        summary = await map_reduce_summary(content, settings, on_token=on_token)
+
+    return {"summary": summary}
+
+
+METADATA_SYSTEM_PROMPT = (
+    "You are an assistant specialized in extracting metadata from research papers. "
+    "Your output should strictly follow this format:\n"
+    "**Title:** <title>\n"
+    "**Authors:** <author1>, <author2>, ...\n"
+    "**Publication Date:** <date>\n"
+    "**Abstract:** <abstract>"
+)
+METADATA_USER_PROMPT = "Extract the metadata from the following text:\n\n{content}"
+
+
+async def metadata_extraction_node(state: StateSchema):
+    """Extract metadata (title, authors, publication date, abstract) using OpenAI API."""
+    content = truncate_to_tokens(state["messages"][-1].content, METADATA_INPUT_TOKENS)
 
     # Call OpenAI GPT to extract metadata
-    response = client.chat.completions.create(
+    metadata_response = await cached_chat_completion(
+        METADATA_SYSTEM_PROMPT,
+        METADATA_USER_PROMPT,
+        content,
         model="gpt-4o",
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an assistant specialized in extracting metadata from research papers. "
-                           "Your output should strictly follow this format:\n"
-                           "**Title:** <title>\n"
-                           "**Authors:** <author1>, <author2>, ...\n"
-                           "**Publication Date:** <date>\n"
-                           "**Abstract:** <abstract>"
-            },
-            {"role": "user", "content": f"Extract the metadata from the following text:\n\n{content}"}
-        ],
         temperature=0.7,
         max_tokens=500,
         n=1,
         stop=None
     )
 
-    metadata_response = response.choices[0].message.content.strip()
-    print(f"Metadata Extraction Response:\n{metadata_response}")
-
     # Initialize metadata dictionary
     metadata = {
         "title": "N/A",
@@ -94,77 +272,451 @@ def metadata_extraction_node(state: StateSchema):
         metadata["abstract"] = abstract_match.group(1).strip()
 
     # Store the parsed metadata in the state
-    state["metadata"] = metadata
-    return state
+    return {"metadata": metadata}
+
+
+EXTRACTION_SYSTEM_PROMPT = (
+    "You are an assistant specialized in analysing research papers. From the paper "
+    "provided, write a concise summary and extract its title, authors, publication "
+    "date, abstract, key findings and methodology. Use \"N/A\" (or an empty list) "
+    "for anything the text does not state."
+)
+EXTRACTION_USER_PROMPT = "Analyse the following research paper:\n\n{content}"
+LONG_EXTRACTION_USER_PROMPT = (
+    "Analyse the following research paper. Its opening pages are given verbatim, "
+    "followed by summaries of consecutive parts of the full text:\n\n{content}"
+)
+
+# JSON schema for the single-call extraction; fields map onto StateSchema
+# ("summary") and the metadata dict
+DOCUMENT_EXTRACTION_SCHEMA = {
+    "name": "document_extraction",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "title": {"type": "string"},
+            "authors": {"type": "array", "items": {"type": "string"}},
+            "publication_date": {"type": "string"},
+            "abstract": {"type": "string"},
+            "key_findings": {"type": "array", "items": {"type": "string"}},
+            "methodology": {"type": "string"},
+        },
+        "required": [
+            "summary", "title", "authors", "publication_date", "abstract", "key_findings", "methodology",
+        ],
+        "additionalProperties": False,
+    },
+}
 
 
-def sentiment_analysis_node(state: StateSchema):
-    """Perform sentiment analysis."""
-    summary = state["summary"]
-    state["sentiment"] = "positive" if "good" in summary.lower() else "neutral"
-    return state
+async def document_extraction_node(state: StateSchema, config: RunnableConfig = None):
+    """
+    Extract the summary and all metadata in one structured-output call.
+
+    This sends the document once instead of once per node. Long documents
+    are condensed chunk by chunk first and sent with their opening pages,
+    where the front matter is.
+    """
+    content = state["messages"][-1].content
+    settings = _settings(config, SUMMARY_SETTINGS)
+
+    user_template = EXTRACTION_USER_PROMPT
+    if count_tokens(content) > settings["summary_single_pass_tokens"]:
+        front_matter = truncate_to_tokens(content, METADATA_INPUT_TOKENS)
+        condensed = await condense_chunks(content, settings)
+        content = f"{front_matter}\n\nSummaries of the full text:\n\n{condensed}"
+        user_template = LONG_EXTRACTION_USER_PROMPT
+
+    response = await cached_chat_completion(
+        EXTRACTION_SYSTEM_PROMPT,
+        user_template,
+        content,
+        model="gpt-4o",
+        temperature=0.7,
+        max_tokens=1000,
+        n=1,
+        response_format={"type": "json_schema", "json_schema": DOCUMENT_EXTRACTION_SCHEMA},
+    )
+    try:
+        extracted = json.loads(response)
+    except json.JSONDecodeError as e:
+        # A truncated or refused response; it was not cached, so a rerun asks again
+        print(f"Invalid document extraction response: {e}")
+        return {"errors": {"document_extraction": f"invalid response: {e}"}}
 
+    metadata = {
+        "title": extracted.get("title") or "N/A",
+        "authors": extracted.get("authors") or [],
+        "publication_date": extracted.get("publication_date") or "N/A",
+        "abstract": extracted.get("abstract") or "N/A",
+        "key_findings": extracted.get("key_findings") or [],
+        "methodology": extracted.get("methodology") or "N/A",
+    }
+    return {"summary": extracted.get("summary", ""), "metadata": metadata}
 
-def entity_recognition_node(state: StateSchema):
-    """Extract entities."""
+
+async def sentiment_analysis_node(state: StateSchema):
+    """Classify the sentiment of the summary with the local CPU model."""
     summary = state["summary"]
-    state["entities"] = {
-        "names": ["Alice"] if "Alice" in summary else [],
-        "dates": ["2025-01-01"] if "2025" in summary else [],
-        "amounts": ["$1000"] if "$1000" in summary else [],
-    }
-    return state
+    return {"sentiment": await sentiment_batcher.submit(summary)}
 
 
-import signal
+async def entity_recognition_node(state: StateSchema):
+    """Extract names, dates and amounts from the summary with the local spaCy model."""
+    summary = state["summary"]
+    entities = await entity_batcher.submit(summary)
+    with span("validation", kind="entities"):
+        validate_extracted_data(entities)
+    return {"entities": entities}
+
+
+# Graph node implementations, keyed by node name
+NODES = {
+    "summarization": summarization_node,
+    "metadata_extraction": metadata_extraction_node,
+    "document_extraction": document_extraction_node,
+    "sentiment_analysis": sentiment_analysis_node,
+    "entity_recognition": entity_recognition_node,
+}
+
+# Nodes whose output each node reads from the state
+NODE_DEPENDENCIES = {
+    "summarization": [],
+    "metadata_extraction": [],
+    "document_extraction": [],
+    "sentiment_analysis": ["summarization"],
+    "entity_recognition": ["summarization"],
+}
+
+# Node that produces the result of each user-selectable task
+TASK_NODES = {
+    "Summary": "summarization",
+    "Metadata Extraction": "metadata_extraction",
+    "Sentiment Analysis": "sentiment_analysis",
+    "Entity Recognition": "entity_recognition",
+}
+
+# State keys each node writes; a node whose keys are all filled in already is skipped
+NODE_OUTPUTS = {
+    "summarization": ["summary"],
+    "metadata_extraction": ["metadata"],
+    "document_extraction": ["summary", "metadata"],
+    "sentiment_analysis": ["sentiment"],
+    "entity_recognition": ["entities"],
+}
+
+# Nodes that a single node can replace when all of them are needed
+COMBINED_NODES = {
+    "document_extraction": {"summarization", "metadata_extraction"},
+}
+
+# "combined" answers summary and metadata with one structured call when
+# both are needed; "separate" always uses one call per node, and is also
+# used by runs that stream their summary
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "combined")
+
+# Seconds a document may spend in the workflow; override per run with run_workflow(timeout=...)
+DOCUMENT_TIMEOUT = float(os.environ.get("DOCUMENT_TIMEOUT", 300))
+
+# Seconds each node may run; override entries per run through
+# config["configurable"]["node_timeouts"]. A node never runs past the
+# document's deadline either.
+NODE_TIMEOUTS = {
+    "summarization": 180,
+    "metadata_extraction": 60,
+    "document_extraction": 240,
+    "sentiment_analysis": 30,
+    "entity_recognition": 30,
+}
+
+
+def with_deadline(name, node, dependencies=()):
+    """
+    Wrap a node so it is cancelled when its time budget runs out.
 
-class TimeoutException(Exception):
-    pass
+    The budget is the node's entry in NODE_TIMEOUTS, capped by the time left
+    until the document deadline in config["configurable"]["deadline"]. A
+    node that times out, or whose dependencies produced nothing, returns an
+    entry in `errors` instead of raising, so the other branches finish and
+    the run returns what it has.
 
-import concurrent.futures
-from langgraph.graph import StateGraph
+    A node whose outputs are already in the state (passed in, or kept in
+    the document's checkpoint from an earlier run) returns without running.
+    """
+    accepted = inspect.signature(node).parameters
+
+    async def run(state: StateSchema, config: RunnableConfig = None, writer: StreamWriter = None):
+        if all(state.get(key) for key in NODE_OUTPUTS[name]):
+            get_telemetry().count("pipeline_nodes_skipped_total", node=name)
+            return {}
+
+        failed = [dep for dep in dependencies if dep in (state.get("errors") or {})]
+        if failed:
+            return {"errors": {name: f"skipped: {', '.join(failed)} failed"}}
+
+        configurable = (config or {}).get("configurable", {})
+        timeout = {**NODE_TIMEOUTS, **configurable.get("node_timeouts", {})}.get(name)
+        if configurable.get("deadline") is not None:
+            remaining = max(0.0, configurable["deadline"] - time.monotonic())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        kwargs = {}
+        if "config" in accepted:
+            kwargs["config"] = config
+        if "writer" in accepted:
+            kwargs["writer"] = writer
+        try:
+            with span(f"node.{name}"):
+                return await asyncio.wait_for(node(state, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            print(f"Node {name} timed out after {timeout:.1f}s")
+            return {"errors": {name: f"timed out after {timeout:.1f}s"}}
 
+    # Not functools.wraps: LangGraph reads the signature to inject config and writer
+    run.__name__ = node.__name__
+    return run
 
-import concurrent.futures
 
-def run_with_timeout(func, args=(), timeout=30):
+def resolve_nodes(selected_tasks, extraction_mode=None):
     """
-    Run a function with a timeout using concurrent.futures.
+    Return the nodes needed for the selected tasks, mapped to the nodes each
+    one depends on within the graph.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future = executor.submit(func, *args)
-        try:
-            return future.result(timeout=timeout)
-        except concurrent.futures.TimeoutError:
-            print(f"Function {func.__name__} timed out after {timeout} seconds.")
-            return None
+    unknown = [task for task in selected_tasks if task not in TASK_NODES]
+    if unknown:
+        raise ValueError(f"Unknown tasks: {unknown}")
+
+    nodes = set()
+    pending = [TASK_NODES[task] for task in selected_tasks]
+    while pending:
+        node = pending.pop()
+        if node not in nodes:
+            nodes.add(node)
+            pending.extend(NODE_DEPENDENCIES[node])
+
+    # Swap node groups for their combined node and point dependants at it
+    replacements = {}
+    if (extraction_mode or EXTRACTION_MODE) == "combined":
+        for combined, group in COMBINED_NODES.items():
+            if group <= nodes:
+                nodes -= group
+                nodes.add(combined)
+                replacements.update(dict.fromkeys(group, combined))
+
+    return {
+        node: sorted({replacements.get(dep, dep) for dep in NODE_DEPENDENCIES[node]})
+        for node in nodes
+    }
+
+
+def build_langgraph_workflow(selected_tasks=None, extraction_mode=None, checkpointer=None):
+    """
+    Build a LangGraph workflow containing only the nodes the selected tasks need.
 
+    The graph is a fan-out/fan-in DAG: nodes without dependencies start
+    together from the entry point, each node follows the nodes it depends
+    on, and the run finishes once every branch has completed. Run it with
+    `ainvoke` so the branches' LLM calls overlap.
 
-def build_langgraph_workflow():
+    With a `checkpointer`, the state after every step is saved under the
+    run's `thread_id`.
     """
-    Build a LangGraph workflow with metadata extraction.
+    if selected_tasks is None:
+        selected_tasks = list(TASK_NODES)
+    plan = resolve_nodes(selected_tasks, extraction_mode)
+    if not plan:
+        raise ValueError("At least one task must be selected.")
+
+    graph_builder = StateGraph(state_schema=StateSchema)
+    for name in NODES:
+        if name in plan:
+            graph_builder.add_node(name, with_deadline(name, NODES[name], plan[name]))
+
+    for name, dependencies in plan.items():
+        if dependencies:
+            graph_builder.add_edge(dependencies, name)
+        else:
+            graph_builder.add_edge(START, name)
+
+    dependents = {dep for dependencies in plan.values() for dep in dependencies}
+    for name in plan.keys() - dependents:
+        graph_builder.add_edge(name, END)
+
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+_workflow_cache = {}
+_workflow_cache_lock = threading.Lock()
+
+
+def get_workflow(selected_tasks, extraction_mode=None):
     """
-    def build_workflow():
-        graph_builder = StateGraph(state_schema=StateSchema)
+    Return the compiled workflow for the selected tasks, building it on first use.
 
-        # Add nodes with unique names
-        graph_builder.add_node("summarization", summarization_node)
-        graph_builder.add_node("metadata_extraction", metadata_extraction_node)  # Renamed from 'metadata'
-        graph_builder.add_node("sentiment_analysis", sentiment_analysis_node)
-        graph_builder.add_node("entity_recognition", entity_recognition_node)
+    Compiled graphs are keyed by the nodes they contain and how those nodes
+    are wired, so task selections that need the same nodes share one graph,
+    and the cache is shared by every document and Streamlit session in the
+    process. Graphs are checkpointed by the "workflow_checkpointer" backend.
+    """
+    plan = resolve_nodes(selected_tasks, extraction_mode)
+    key = frozenset((node, tuple(deps)) for node, deps in plan.items())
+    workflow = _workflow_cache.get(key)
+    if workflow is None:
+        with _workflow_cache_lock:
+            workflow = _workflow_cache.get(key)
+            if workflow is None:
+                workflow = build_langgraph_workflow(
+                    selected_tasks, extraction_mode, checkpointer=get_backend("workflow_checkpointer")
+                )
+                _workflow_cache[key] = workflow
+    return workflow
+
+
+def run_workflow(workflow, state, config=None, on_summary_token=None, priority=None, timeout=None,
+                 thread_id=None):
+    """
+    Run a compiled workflow on the shared event loop and return the final state.
 
-        # Define task order
-        graph_builder.add_edge("summarization", "metadata_extraction")  # Updated edge
-        graph_builder.add_edge("metadata_extraction", "sentiment_analysis")
-        graph_builder.add_edge("sentiment_analysis", "entity_recognition")
+    The run gets `timeout` seconds (DOCUMENT_TIMEOUT by default): nodes are
+    cancelled at the deadline and the state reached so far is returned,
+    with an `errors` entry for every node that did not finish.
 
-        # Set entry and exit points
-        graph_builder.set_entry_point("summarization")
-        graph_builder.set_finish_point("entity_recognition")
+    With `on_summary_token`, summary tokens are streamed to the callback on
+    the calling thread while the graph runs. `priority` (see llm_scheduler)
+    orders the run's LLM requests against other runs; batch by default.
 
-        return graph_builder.compile()
+    A checkpointed workflow runs on `thread_id`, by default the document's
+    stable ID. The run starts from the outputs stored on that thread, and a
+    run that was interrupted by an exception resumes with the nodes it had
+    not finished. Only the thread's latest checkpoint is kept.
+    """
+    timeout = DOCUMENT_TIMEOUT if timeout is None else timeout
+    tokens = queue.Queue()
+    config = {**(config or {})}
+    configurable = {**config.get("configurable", {}), "deadline": time.monotonic() + timeout}
+    if on_summary_token is not None:
+        configurable["stream_summary"] = True
+    if workflow.checkpointer is not None:
+        configurable["thread_id"] = thread_id or stable_document_id(state["messages"][-1].content)
+    config["configurable"] = configurable
+
+    async def run():
+        # Set inside the task, so every node the graph spawns inherits it
+        if priority is not None:
+            request_priority.set(priority)
+        final_state = state
+        run_input = {**state, "errors": None}
+        if workflow.checkpointer is not None:
+            snapshot = await workflow.aget_state(config)
+            if snapshot.next and set(snapshot.next) <= set(workflow.nodes):
+                run_input = None  # Continue the interrupted run instead of starting over
+
+        async def stream():
+            nonlocal final_state
+            async for mode, chunk in workflow.astream(run_input, config, stream_mode=["custom", "values"]):
+                if mode == "values":
+                    final_state = chunk
+                elif "summary_token" in chunk:
+                    tokens.put(chunk["summary_token"])
 
-    return run_with_timeout(build_workflow, timeout=30)
+        try:
+            # Nodes stop themselves at the deadline; this only catches what they miss
+            with span("workflow"):
+                await asyncio.wait_for(stream(), timeout + 5)
+        except asyncio.TimeoutError:
+            errors = {**final_state.get("errors", {}), "workflow": f"deadline of {timeout:.0f}s exceeded"}
+            final_state = {**final_state, "errors": errors}
+        finally:
+            tokens.put(None)
+        if workflow.checkpointer is not None:
+            # Resuming and reusing results only need the latest checkpoint; older
+            # ones would each keep another copy of the document text
+            try:
+                await workflow.checkpointer.aprune([configurable["thread_id"]])
+            except NotImplementedError:
+                pass
+        return final_state
+
+    future = asyncio.run_coroutine_threadsafe(run(), get_event_loop())
+    while (token := tokens.get()) is not None:
+        on_summary_token(token)
+    return future.result()
+
+
+def get_stored_state(document_id):
+    """Return the node outputs checkpointed for a document, or {} if there are none."""
+    checkpointer = get_backend("workflow_checkpointer")
+    if checkpointer is None:
+        return {}
+    checkpoint = run_async(checkpointer.aget({"configurable": {"thread_id": document_id, "checkpoint_ns": ""}}))
+    values = (checkpoint or {}).get("channel_values", {})
+    return {key: values[key] for key in StateSchema.__annotations__ if key != "errors" and values.get(key)}
+
+
+def run_selected_tasks(state, selected_tasks, extraction_mode=None, **kwargs):
+    """
+    Run the selected tasks on a document and return its final state.
 
+    Tasks whose results are already known, from `state` or from the
+    document's checkpoint, are not run again, so asking for more tasks
+    later only runs the missing nodes. Other keyword arguments go to
+    run_workflow.
 
+    A run that streams its summary (`on_summary_token`) keeps summarization
+    separate, since the combined extraction node answers in JSON.
+    """
+    if kwargs.get("on_summary_token") is not None:
+        extraction_mode = "separate"
+    resolve_nodes(selected_tasks, extraction_mode)  # Rejects unknown tasks
+    document_id = stable_document_id(state["messages"][-1].content)
+    known = {**get_stored_state(document_id), **state}
+    pending = [task for task in selected_tasks
+               if not all(known.get(key) for key in NODE_OUTPUTS[TASK_NODES[task]])]
+    if not pending:
+        return known
+    return run_workflow(get_workflow(pending, extraction_mode), state, thread_id=document_id, **kwargs)
+
+
+def run_document_tasks(text, selected_tasks, pdf_source=None, **kwargs):
+    """
+    Run the selected tasks on a document's text and return its final state.
 
+    When `pdf_source` (a path or the PDF's bytes) is given, metadata is
+    first read locally from the PDF, and the LLM is only asked for it when
+    the local result is not confident enough. Other keyword arguments go to
+    run_selected_tasks.
+    """
+    state = {"messages": [HumanMessage(content=text)]}
+    workflow_tasks = list(selected_tasks)
+    if "Metadata Extraction" in workflow_tasks and pdf_source is not None:
+        try:
+            metadata, confidence = extract_local_metadata(pdf_source)
+        except Exception as e:
+            print(f"Local metadata extraction failed: {e}")
+            confidence = 0.0
+        if confidence >= LOCAL_METADATA_CONFIDENCE:
+            state["metadata"] = metadata
+            workflow_tasks.remove("Metadata Extraction")
+
+    if not workflow_tasks:
+        return state
+    return run_selected_tasks(state, workflow_tasks, **kwargs)
+
+
+def document_row(text, state):
+    """The BigQuery row for a document's final workflow state."""
+    metadata = state.get("metadata", {})
+    return {
+        "document_id": stable_document_id(text),  # Stable digest of the text as a unique document ID
+        "title": metadata.get("title", "N/A"),
+        "authors": metadata.get("authors", []),
+        "publication_date": metadata.get("publication_date", "N/A"),
+        "abstract": metadata.get("abstract", "N/A"),
+        "key_findings": metadata.get("key_findings", []),
+        "methodology": metadata.get("methodology", "N/A"),
+        "summary": state.get("summary", "N/A"),
+        "sentiment": state.get("sentiment", "Unknown"),
+        "entities": state.get("entities", {}),
+    }
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import time
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from text_chunking import count_tokens
+
+
+# Requests from the UI are dispatched ahead of queued batch work
+INTERACTIVE = 0
+BATCH = 10
+
+# Priority of the requests made by the current task; set once per workflow run
+request_priority = contextvars.ContextVar("request_priority", default=BATCH)
+
+# Completion tokens assumed for requests that do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+
+
+def estimate_prompt_tokens(messages, model="gpt-4o"):
+    """Estimate the prompt tokens of a chat request, including per-message overhead."""
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3
+
+
+def estimate_request_tokens(params):
+    """
+    Estimate the tokens a chat request counts against the TPM limit.
+
+    OpenAI reserves the prompt plus `max_tokens` for each choice when the
+    request is admitted, so that is what the bucket is charged up front.
+    """
+    model = params.get("model", "gpt-4o")
+    completion = params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return estimate_prompt_tokens(params["messages"], model) + completion * (params.get("n") or 1)
+
+
+class TokenBucket:
+    """A bucket holding up to `per_minute` units, refilled continuously."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.capacity = capacity or per_minute
+        self.rate = per_minute / 60.0
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (requests above capacity wait for a full bucket)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def consume(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _HeldStream:
+    """
+    A streamed response that keeps its request's concurrency slot until it
+    has been read to the end, fails or is closed.
+    """
+
+    def __init__(self, stream, scheduler, cost):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._scheduler = scheduler
+        self._cost = cost
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            chunk = await self._iterator.__anext__()
+        except BaseException:  # Including StopAsyncIteration at the end of the stream
+            self._finish()
+            raise
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self._scheduler.tokens.refund(max(0, self._cost - usage.total_tokens))
+        return chunk
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _finish(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release()
+
+
+class RequestScheduler:
+    """
+    Admit chat completion requests under RPM/TPM limits, by priority.
+
+    Requests wait in a priority queue (lower values first, FIFO within a
+    priority) until both token buckets can cover them and fewer than
+    `max_concurrency` requests are in flight. Rate-limit, server and
+    connection errors are retried with jittered exponential backoff; a 429
+    honours the server's Retry-After and pauses all dispatching until then,
+    so parallel documents back off together instead of hammering the API.
+
+    The scheduler works with any AsyncOpenAI-compatible client, so pointing
+    the client at a mock server (`OPENAI_BASE_URL`) exercises it offline.
+    The client should be created with `max_retries=0`.
+    """
+
+    def __init__(self, client, rpm=500, tpm=30_000, max_concurrency=16, max_retries=5, base_delay=1.0,
+                 max_delay=60.0):
+        self.client = client
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0}
+        self._waiting = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._dispatcher = None
+
+    @classmethod
+    def from_env(cls, client):
+        """Build a scheduler with limits from OPENAI_RPM, OPENAI_TPM and OPENAI_MAX_CONCURRENCY."""
+        return cls(
+            client,
+            rpm=int(os.environ.get("OPENAI_RPM", 500)),
+            tpm=int(os.environ.get("OPENAI_TPM", 30_000)),
+            max_concurrency=int(os.environ.get("OPENAI_MAX_CONCURRENCY", 16)),
+        )
+
+    async def create(self, priority=None, **params):
+        """
+        Make a `chat.completions.create` call once the limits allow it, retrying transient failures.
+
+        A streamed request holds its concurrency slot until the returned
+        stream is exhausted or closed, so read it to the end or use it as an
+        async context manager.
+        """
+        priority = request_priority.get() if priority is None else priority
+        cost = estimate_request_tokens(params)
+        for attempt in range(self.max_retries + 1):
+            await self._admit(priority, cost)
+            try:
+                response = await self.client.chat.completions.create(**params)
+            except BaseException as e:
+                self._release()
+                if not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                if attempt == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                    raise
+                delay = self._retry_delay(e, attempt)
+                self.stats["retries"] += 1
+                if isinstance(e, RateLimitError):
+                    self.stats["rate_limited"] += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"OpenAI request failed ({e.__class__.__name__}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if params.get("stream"):
+                return _HeldStream(response, self, cost)
+            self._release()
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                # Give back what the estimate over-reserved
+                self.tokens.refund(max(0, cost - usage.total_tokens))
+            return response
+
+    def _retry_delay(self, error, attempt):
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000 + random.uniform(0, self.base_delay)
+            if headers.get("retry-after"):
+                return float(headers["retry-after"]) + random.uniform(0, self.base_delay)
+        except ValueError:
+            pass  # An HTTP date rather than seconds
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(backoff / 2, backoff)
+
+    async def _admit(self, priority, cost):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), cost, future))
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # Admitted just before being cancelled
+            raise
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while self._waiting:
+            self._wakeup.clear()
+            priority, _, cost, future = self._waiting[0]
+            if future.done():
+                heapq.heappop(self._waiting)  # The waiter was cancelled
+                continue
+            if self._in_flight >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            delay = max(self._paused_until - time.monotonic(), self.requests.wait_time(1),
+                        self.tokens.wait_time(cost))
+            if delay > 0:
+                # Re-check early if a more urgent request arrives in the meantime
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._waiting)
+            self.requests.consume(1)
+            self.tokens.consume(cost)
+            self._in_flight += 1
+            self.stats["requests"] += 1
+            future.set_result(None)
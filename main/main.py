@@ -0,0 +1,438 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from backends import get_backend
+from corpus_index import DEFAULT_INDEX_PATH, CorpusIndex
+from data_downloader import get_downloader
+from data_processor import extract_pdfs
+from gcp_utils import close_sinks, store_in_bigquery
+from llm_cache import get_llm_cache
+from openai_batch import BatchQueued, enable_offline_batch
+from scholar_search import get_scholar_search
+from telemetry import get_telemetry
+from utils import run_async, stable_document_id
+
+
+DEFAULT_TOPIC = "deep learning"
+DEFAULT_BASE_FOLDER = "data/"
+DEFAULT_CHECKPOINT = os.path.join(".cache", "pipeline_checkpoint.jsonl")
+
+# Items buffered between two stages before the upstream stage blocks
+QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+class PipelineStats:
+    """Thread-safe per-stage latencies and document counts for one run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.counts = {"completed": 0, "skipped": 0, "failed": 0, "queued": 0}
+        self.started = time.perf_counter()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.latencies.setdefault(stage, []).append(seconds)
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def report(self):
+        """Print throughput and the latency distribution of every stage."""
+        elapsed = time.perf_counter() - self.started
+        completed = self.counts["completed"]
+        print(f"\nProcessed {completed} documents in {elapsed:.1f}s "
+              f"({completed / elapsed if elapsed else 0.0:.2f} docs/sec); "
+              f"skipped {self.counts['skipped']}, failed {self.counts['failed']}, "
+              f"queued for batch {self.counts['queued']}")
+        for stage, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"  {stage:<10} n={len(latencies):<5} mean={statistics.mean(latencies):.3f}s "
+                  f"p50={statistics.median(latencies):.3f}s p95={p95:.3f}s")
+
+        telemetry = get_telemetry().summary()
+        print(f"  LLM tokens: {telemetry['prompt_tokens']:.0f} prompt + {telemetry['completion_tokens']:.0f} "
+              f"completion, estimated cost ${telemetry['cost_usd']:.4f}")
+        print(f"  Downloaded {telemetry['bytes_downloaded'] / 1e6:.1f} MB, extracted "
+              f"{telemetry['pages_extracted']:.0f} pages")
+        for cache, hit_rate in sorted(telemetry["cache_hit_rates"].items()):
+            print(f"  {cache} cache hit rate: {hit_rate:.0%}")
+
+
+class Checkpoint:
+    """
+    Append-only JSONL record of completed documents.
+
+    Each line holds a document's source (URL or path), content hash and
+    the workflow tasks run on it, so a resumed run skips both sources it
+    has already processed and copies of the same file under another name,
+    unless it asks for tasks they were not processed with.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT):
+        self.path = path
+        self._lock = threading.Lock()
+        # Key -> tasks completed for it
+        self._done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash
+                    self._record(entry)
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _record(self, entry):
+        for key in (entry["source"], entry["sha256"], entry["document_id"]):
+            if key:
+                self._done.setdefault(key, set()).update(entry["tasks"])
+
+    def covers(self, key, tasks=()):
+        """Whether `key` was completed with every one of `tasks`."""
+        return key in self._done and set(tasks) <= self._done[key]
+
+    def mark(self, source, sha256, document_id, tasks=()):
+        entry = {"source": source, "sha256": sha256, "document_id": document_id, "tasks": list(tasks)}
+        with self._lock:
+            self._record(entry)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def in_background(items, maxsize=QUEUE_SIZE):
+    """
+    Iterate `items` on a background thread and yield them through a bounded queue.
+
+    This decouples two generator stages: the upstream stage keeps working
+    while the downstream one is busy, and blocks once `maxsize` items are
+    waiting.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+        finally:
+            buffer.put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (item := buffer.get()) is not _DONE:
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def bounded_map(fn, items, workers):
+    """Apply `fn` to `items` on `workers` threads, yielding results as they complete."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for item in items:
+            if len(in_flight) >= workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(executor.submit(fn, item))
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _timed(stage, stats, fn):
+    """Wrap a per-document stage function to record its latency and catch its errors."""
+    def run(document):
+        if document.get("error"):
+            return document
+        start = time.perf_counter()
+        try:
+            fn(document)
+        except Exception as e:
+            print(f"{stage} failed for {document['source']}: {e}")
+            document["error"] = f"{stage}: {e}"
+        stats.record(stage, time.perf_counter() - start)
+        return document
+    return run
+
+
+def topic_folder(base_folder, topic):
+    return os.path.join(base_folder, topic.replace(" ", "_"))
+
+
+def search_sources(topics, base_folder, num_results):
+    """Yield a download item for every PDF link found for each topic, searching the topics concurrently."""
+    for topic, urls in get_scholar_search().search_many(topics, num_results):
+        print(f"Found {len(urls)} PDF links for {topic!r}")
+        for url in urls:
+            yield {"source": url, "url": url, "topic": topic, "folder": topic_folder(base_folder, topic)}
+
+
+def folder_sources(folder, topic=None, num_files=None):
+    """Yield an item for each PDF in a folder, in name order."""
+    names = sorted(name for name in os.listdir(folder) if name.endswith(".pdf"))
+    for name in names[:num_files]:
+        path = os.path.join(folder, name)
+        yield {"source": os.path.abspath(path), "path": path, "topic": topic}
+
+
+def manifest_sources(manifest, base_folder):
+    """
+    Yield an item for each entry of a manifest file.
+
+    Each line is a PDF path or URL, or a JSON object with a `path` or `url`
+    and an optional `topic`. URLs are downloaded into the topic's folder.
+    """
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            location = entry.get("url") or entry.get("path")
+            topic = entry.get("topic")
+            if location.startswith(("http://", "https://")):
+                folder = topic_folder(base_folder, topic or "manifest")
+                yield {"source": location, "url": location, "topic": topic, "folder": folder}
+            else:
+                yield {"source": os.path.abspath(location), "path": location, "topic": topic}
+
+
+def download_document(document, index):
+    """
+    Download a URL item to `paper_<url hash>.pdf` in its folder, unless already there.
+
+    A URL the corpus index saw downloaded elsewhere reuses that file.
+    """
+    if "url" not in document:
+        return
+    known = index.lookup_url(document["url"])
+    if known and known["path"] and os.path.exists(known["path"]):
+        document["path"] = known["path"]
+        return
+    file_hash = hashlib.md5(document["url"].encode()).hexdigest()
+    save_path = os.path.join(document["folder"], f"paper_{file_hash}.pdf")
+    if not os.path.exists(save_path):
+        os.makedirs(document["folder"], exist_ok=True)
+        if not get_downloader().download(document["url"], save_path):
+            raise RuntimeError("download failed")
+    index.record_download(document["url"], save_path)
+    document["path"] = save_path
+
+
+def extract_documents(documents, max_pages, batch_size, stats, checkpoint, index, tasks=()):
+    """
+    Extract text for documents in batches of `batch_size`, one process pool per batch.
+
+    Documents whose content hash is already checkpointed, or that the
+    corpus index holds as the same file, the same text or a near-duplicate,
+    are dropped here, before any LLM call. A copy of a document processed
+    without some of `tasks` is kept, so the workflow can run the missing ones.
+    """
+    # Copies of one paper met in this run, before the first of them is stored
+    in_flight = CorpusIndex(":memory:", threshold=index.threshold)
+
+    def extract(batch):
+        start = time.perf_counter()
+        extracted = extract_pdfs([document["path"] for document in batch], max_pages=max_pages)
+        elapsed = time.perf_counter() - start
+        for document, result in zip(batch, extracted):
+            stats.record("extract", elapsed / len(batch))
+            document.update(sha256=result["sha256"], page_count=result["page_count"], text=result["text"])
+            if result.get("error") or not result["page_count"]:
+                document["error"] = f"extract: {result.get('error', 'no pages')}"
+            elif checkpoint.covers(result["sha256"], tasks):
+                stats.count("skipped")
+                continue
+            else:
+                duplicate = index.resolve(sha256=result["sha256"], text=result["text"])
+                if duplicate and "url" in document:
+                    # Later runs skip this URL before downloading it
+                    index.add(duplicate["document_id"], url=document["url"], path=document["path"])
+                if (duplicate and duplicate["match"] != "near_duplicate"
+                        and not index.covers(duplicate["document_id"], tasks)):
+                    # Same text as before: the workflow reuses its stored results
+                    duplicate = None
+                duplicate = duplicate or in_flight.resolve(sha256=result["sha256"], text=result["text"])
+                if duplicate:
+                    print(f"Already in corpus as {duplicate['document_id'][:12]} ({duplicate['match']}): "
+                          f"{document['source']}")
+                    get_telemetry().count("pipeline_duplicates_total", match=duplicate["match"])
+                    stats.count("skipped")
+                    continue
+                in_flight.add(stable_document_id(result["text"]), text=result["text"], sha256=result["sha256"])
+            yield document
+
+    batch = []
+    for document in documents:
+        if document.get("error"):
+            yield document
+            continue
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield from extract(batch)
+            batch = []
+    if batch:
+        yield from extract(batch)
+
+
+def run_tasks(document, selected_tasks):
+    """Run the workflow for a document, reading metadata locally when it is confident enough."""
+    # Imported here so download-only workers never load LangGraph or the OpenAI client
+    from langgraph_workflow import run_document_tasks
+
+    try:
+        document["state"] = run_document_tasks(document["text"], selected_tasks, pdf_source=document["path"])
+    except BatchQueued:
+        # Offline mode: finished by a later run once the batch results are cached
+        document["queued"] = True
+
+
+def run_pipeline(sources, args, process=True):
+    """
+    Stream documents through download -> extract -> workflow -> store.
+
+    Every stage is a generator; stages are joined by bounded queues so they
+    run concurrently without buffering the whole corpus, and each stage
+    keeps at most its configured number of documents in flight.
+    """
+    stats = PipelineStats()
+    checkpoint = Checkpoint(args.checkpoint)
+    index = CorpusIndex(args.corpus_index)
+    tasks = args.tasks or ()
+
+    def pending(items):
+        for item in items:
+            known = "url" in item and index.resolve(url=item["url"])
+            if checkpoint.covers(item["source"], tasks) or (known and index.covers(known["document_id"], tasks)):
+                stats.count("skipped")
+                continue
+            yield item
+
+    # Local paths pass through the download stage untouched
+    download = _timed("download", stats, lambda document: download_document(document, index))
+    documents = in_background(bounded_map(download, in_background(pending(sources)), args.download_workers))
+    if process:
+        # Imported here so download-only runs never load LangGraph
+        from langgraph_workflow import document_row
+
+        documents = in_background(
+            extract_documents(documents, args.max_pages, args.extract_batch, stats, checkpoint, index, tasks)
+        )
+        run = _timed("workflow", stats, lambda document: run_tasks(document, args.tasks))
+        documents = in_background(bounded_map(run, documents, args.concurrency))
+
+    try:
+        for document in documents:
+            if document.get("error"):
+                stats.count("failed")
+                continue
+            if document.get("queued"):
+                stats.count("queued")
+                continue
+            if document.get("state", {}).get("errors"):
+                # Partial results are not stored; a rerun retries the document, mostly from the LLM cache
+                print(f"Incomplete: {document['source']}: {document['state']['errors']}")
+                stats.count("failed")
+                continue
+            if process:
+                start = time.perf_counter()
+                row = document_row(document["text"], document["state"])
+                store_in_bigquery(args.dataset, args.table, row)
+                stats.record("store", time.perf_counter() - start)
+                checkpoint.mark(document["source"], document["sha256"], row["document_id"], tasks)
+                index.add(row["document_id"], text=document["text"], sha256=document["sha256"],
+                          url=document.get("url"), path=document["path"], tasks=tasks)
+                print(f"Processed: {document['source']}")
+            else:
+                print(f"Downloaded: {document['source']} -> {document['path']}")
+            stats.count("completed")
+    finally:
+        close_sinks()
+        stats.report()
+        get_telemetry().flush()
+
+
+def build_sources(args, remote):
+    """Chain the sources given on the command line."""
+    if args.manifest:
+        yield from manifest_sources(args.manifest, args.base_folder)
+    if args.dir:
+        yield from folder_sources(args.dir, num_files=args.num_files)
+    if args.dir or args.manifest:
+        return
+    if remote:
+        yield from search_sources(args.topic, args.base_folder, args.num_results)
+        return
+    for topic in args.topic:
+        yield from folder_sources(topic_folder(args.base_folder, topic), topic, args.num_files)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download and process research papers without the UI.")
+    parser.add_argument("command", nargs="?", default="full",
+                        choices=["full", "downloader", "processor", "batch_submit", "batch_collect"])
+    parser.add_argument("--topic", action="append", help="Search topic; repeat for several topics")
+    parser.add_argument("--dir", help="Process the PDFs in this directory instead of a topic folder")
+    parser.add_argument("--manifest", help="File listing PDF paths or URLs, one per line (or JSON objects)")
+    parser.add_argument("--base_folder", default=DEFAULT_BASE_FOLDER)
+    parser.add_argument("--max_pages", type=int, default=10)
+    parser.add_argument("--num_results", type=int, default=5)
+    parser.add_argument("--num_files", type=int, default=None, help="PDFs to process per folder (default: all)")
+    parser.add_argument("--tasks", nargs="+", help="Workflow tasks to run (default: all)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Documents in the workflow at once")
+    parser.add_argument("--download_workers", type=int, default=8)
+    parser.add_argument("--extract_batch", type=int, default=8, help="Documents extracted per process pool")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--corpus_index", default=os.environ.get("CORPUS_INDEX_PATH", DEFAULT_INDEX_PATH),
+                        help="SQLite index of documents already in the corpus")
+    parser.add_argument("--offline_batch", action="store_true",
+                        help="Queue uncached LLM requests for the OpenAI Batch API instead of sending them")
+    parser.add_argument("--dataset", default="llm_metadata")
+    parser.add_argument("--table", default="documents")
+    args = parser.parse_args(argv)
+    args.topic = args.topic or [DEFAULT_TOPIC]
+    if args.command in ("full", "processor"):
+        from langgraph_workflow import TASK_NODES
+
+        unknown = [task for task in args.tasks or [] if task not in TASK_NODES]
+        if unknown:
+            parser.error(f"unknown tasks {unknown}; choose from {list(TASK_NODES)}")
+        args.tasks = args.tasks or list(TASK_NODES)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.offline_batch or args.command.startswith("batch_"):
+        offline_batch = enable_offline_batch()
+    if args.command == "batch_submit":
+        run_async(offline_batch.submit(get_backend("openai")))
+    elif args.command == "batch_collect":
+        run_async(offline_batch.collect(get_backend("openai"), get_llm_cache()))
+    elif args.command == "downloader":
+        run_pipeline(build_sources(args, remote=True), args, process=False)
+    elif args.command == "processor":
+        run_pipeline(build_sources(args, remote=False), args)
+    else:
+        run_pipeline(build_sources(args, remote=True), args)
+
+
+if __name__ == "__main__":
+    main()
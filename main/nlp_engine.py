@@ -0,0 +1,168 @@
+import asyncio
+import os
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from backends import get_backend
+from utils import VALIDATION_RULES
+
+
+SPACY_MODEL = os.environ.get("SPACY_MODEL", "en_core_web_sm")
+SENTIMENT_MODEL = os.environ.get("SENTIMENT_MODEL", "distilbert-base-uncased-finetuned-sst-2-english")
+
+# Below this classifier confidence a text is reported as "neutral"
+NEUTRAL_THRESHOLD = 0.6
+
+DATE_FORMATS = ["%Y-%m-%d", "%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%m/%d/%Y"]
+
+
+def load_spacy_model():
+    """Load the spaCy NER pipeline."""
+    import spacy
+
+    # Only the entity recognizer is needed
+    return spacy.load(SPACY_MODEL, disable=["parser", "lemmatizer"])
+
+
+def load_sentiment_pipeline():
+    """Load the CPU sentiment classifier."""
+    from transformers import pipeline
+
+    return pipeline("sentiment-analysis", model=SENTIMENT_MODEL, device=-1)
+
+
+def get_spacy_model():
+    """Return the process-wide spaCy pipeline (the "spacy" backend), loading it on first use."""
+    return get_backend("spacy")
+
+
+def get_sentiment_pipeline():
+    """Return the process-wide sentiment classifier (the "sentiment" backend), loading it on first use."""
+    return get_backend("sentiment")
+
+
+def _normalize_date(text):
+    text = " ".join(re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text).split())
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def _normalize_amount(text):
+    match = re.fullmatch(r"\$\s?([\d,]+)(?:\.\d+)?|([\d,]+)(?:\.\d+)?\s*(?:dollars|USD)", text.strip())
+    if not match:
+        return None
+    return "$" + (match.group(1) or match.group(2)).replace(",", "")
+
+
+def _normalize_name(text):
+    # Strip accents ("José Álvarez" -> "Jose Alvarez") and the periods of initials
+    decomposed = unicodedata.normalize("NFKD", text)
+    name = " ".join("".join(c for c in decomposed if not unicodedata.combining(c)).replace(".", " ").split())
+    # Names that would still need a word cut apart to pass validation are dropped
+    return name if re.fullmatch(r"[A-Za-z ]+", name) else None
+
+
+def entities_from_doc(doc):
+    """
+    Map a spaCy doc's PERSON, DATE and MONEY entities onto the names/dates/
+    amounts shape checked by `validate_extracted_data`.
+
+    Values are normalized (ISO dates, "$1000" amounts) and anything that
+    still does not match the validation rules is dropped.
+    """
+    entities = {"names": [], "dates": [], "amounts": []}
+    normalizers = {"PERSON": ("names", _normalize_name), "DATE": ("dates", _normalize_date),
+                   "MONEY": ("amounts", _normalize_amount)}
+    for ent in doc.ents:
+        if ent.label_ not in normalizers:
+            continue
+        key, normalize = normalizers[ent.label_]
+        value = normalize(ent.text)
+        if value and re.match(VALIDATION_RULES[key], value) and value not in entities[key]:
+            entities[key].append(value)
+    return entities
+
+
+def recognize_entities(texts, batch_size=32, n_process=1):
+    """Extract entities from many texts with one batched `nlp.pipe` pass."""
+    nlp = get_spacy_model()
+    return [entities_from_doc(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)]
+
+
+def analyze_sentiment(texts, batch_size=32):
+    """Classify many texts as positive, negative or neutral in batches."""
+    if not texts:
+        return []
+    classifier = get_sentiment_pipeline()
+    predictions = classifier(list(texts), batch_size=batch_size, truncation=True)
+    return [
+        prediction["label"].lower() if prediction["score"] >= NEUTRAL_THRESHOLD else "neutral"
+        for prediction in predictions
+    ]
+
+
+def analyze_documents(texts, batch_size=32, n_process=1):
+    """Return `{"sentiment", "entities"}` for each text, running each model once over the batch."""
+    sentiments = analyze_sentiment(texts, batch_size=batch_size)
+    entities = recognize_entities(texts, batch_size=batch_size, n_process=n_process)
+    return [{"sentiment": s, "entities": e} for s, e in zip(sentiments, entities)]
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-item async requests into batched calls.
+
+    Items submitted within `max_wait` seconds of each other (up to
+    `max_batch`) are passed to `batch_fn` together on a dedicated worker
+    thread, so workflow nodes running for many documents at once share one
+    model invocation instead of making one each.
+    """
+
+    def __init__(self, batch_fn, max_batch=32, max_wait=0.02):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        # One worker thread: models are not shared between concurrent calls
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self.batch_fn, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+sentiment_batcher = MicroBatcher(analyze_sentiment)
+entity_batcher = MicroBatcher(recognize_entities)
@@ -0,0 +1,180 @@
+import io
+import json
+import os
+import threading
+
+
+DEFAULT_BATCH_DIR = os.path.join(".cache", "openai_batch")
+
+# OpenAI accepts at most this many requests per batch input file
+MAX_BATCH_REQUESTS = 50_000
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class BatchQueued(Exception):
+    """Raised in offline mode when a request was queued for the Batch API instead of sent."""
+
+
+class OfflineBatch:
+    """
+    Collect chat completion requests for the OpenAI Batch API.
+
+    In offline mode, LLM cache misses are appended to `pending.jsonl`
+    under their cache key instead of being sent. `submit` uploads the
+    pending requests as batch jobs; `collect` downloads finished jobs and
+    writes each response into the LLM cache under the same key, so running
+    the pipeline again answers those requests from the cache. Steps that
+    depend on earlier responses (the reduce step of a long summary) need
+    one more submit/collect round each.
+    """
+
+    def __init__(self, directory=DEFAULT_BATCH_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._pending_path = os.path.join(directory, "pending.jsonl")
+        self._jobs_path = os.path.join(directory, "batches.json")
+        self.jobs = {}
+        if os.path.exists(self._jobs_path):
+            with open(self._jobs_path) as f:
+                self.jobs = json.load(f)
+
+        # Keys already pending or in a running job are not queued twice
+        self._queued = set(self._read_keys(self._pending_path))
+        for batch_id, job in self.jobs.items():
+            if not job.get("collected"):
+                self._queued.update(self._read_keys(self._input_path(batch_id)))
+
+    def _input_path(self, batch_id):
+        return os.path.join(self.directory, f"{batch_id}.jsonl")
+
+    @staticmethod
+    def _read_keys(path):
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+    def _write_jobs(self):
+        tmp_path = self._jobs_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(tmp_path, self._jobs_path)
+
+    def queue(self, key, body):
+        """Queue one request body (`messages` plus parameters) under its cache key."""
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+            line = {"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+            with open(self._pending_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def _drop_pending(self, count):
+        """Remove the first `count` pending requests, once they are in a batch job."""
+        with open(self._pending_path, encoding="utf-8") as f:
+            remaining = [line for line in f if line.strip()][count:]
+        if not remaining:
+            os.remove(self._pending_path)
+            return
+        tmp_path = self._pending_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(remaining)
+        os.replace(tmp_path, self._pending_path)
+
+    async def submit(self, client):
+        """
+        Upload the pending requests as batch jobs and return their IDs.
+
+        Requests leave `pending.jsonl` only once their batch job exists, so
+        a failed upload leaves them queued for the next submit.
+        """
+        with self._lock:
+            if not os.path.exists(self._pending_path):
+                return []
+            with open(self._pending_path, encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+
+        batch_ids = []
+        for start in range(0, len(lines), MAX_BATCH_REQUESTS):
+            requests = lines[start:start + MAX_BATCH_REQUESTS]
+            chunk = "".join(requests)
+            upload = await client.files.create(
+                file=("requests.jsonl", io.BytesIO(chunk.encode("utf-8"))), purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=upload.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+            )
+            with open(self._input_path(batch.id), "w", encoding="utf-8") as f:
+                f.write(chunk)
+            with self._lock:
+                self.jobs[batch.id] = {"status": batch.status, "requests": len(requests), "collected": False}
+                self._write_jobs()
+                # Requests queued meanwhile were appended, so the submitted ones are still first
+                self._drop_pending(len(requests))
+            batch_ids.append(batch.id)
+            print(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return batch_ids
+
+    async def collect(self, client, cache):
+        """
+        Store the responses of finished jobs in `cache`.
+
+        Returns `{batch_id: status}` for every job not collected before.
+        Failed, expired and cancelled jobs are closed, so their requests are
+        queued again the next time the pipeline runs.
+        """
+        statuses = {}
+        for batch_id, job in list(self.jobs.items()):
+            if job.get("collected"):
+                continue
+            batch = await client.batches.retrieve(batch_id)
+            statuses[batch_id] = job["status"] = batch.status
+            if batch.status not in ("completed", "failed", "expired", "cancelled"):
+                continue
+
+            stored = failed = 0
+            if batch.output_file_id:
+                output = await client.files.content(batch.output_file_id)
+                for line in output.text.splitlines():
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    response = result.get("response") or {}
+                    choice = (response.get("body") or {}).get("choices", [{}])[0]
+                    content = (choice.get("message") or {}).get("content")
+                    # Truncated or refused responses are left out, so the pipeline asks again
+                    if response.get("status_code") == 200 and choice.get("finish_reason") == "stop" and content:
+                        cache.set(result["custom_id"], content.strip())
+                        stored += 1
+                    else:
+                        failed += 1
+            print(f"Batch {batch_id} {batch.status}: {stored} responses cached, {failed} failed")
+
+            with self._lock:
+                job.update(collected=True, stored=stored, failed=failed)
+                self._queued.difference_update(self._read_keys(self._input_path(batch_id)))
+                self._write_jobs()
+        return statuses
+
+
+_offline_batch = None
+_offline_batch_lock = threading.Lock()
+
+
+def enable_offline_batch(directory=None):
+    """Switch LLM calls in this process to queueing for the Batch API."""
+    global _offline_batch
+    with _offline_batch_lock:
+        if _offline_batch is None:
+            _offline_batch = OfflineBatch(directory or os.environ.get("OPENAI_BATCH_DIR", DEFAULT_BATCH_DIR))
+    return _offline_batch
+
+
+def get_offline_batch():
+    """Return the offline batch queue if offline mode is on (or `OPENAI_OFFLINE_BATCH` is set), else None."""
+    if _offline_batch is None and os.environ.get("OPENAI_OFFLINE_BATCH"):
+        return enable_offline_batch()
+    return _offline_batch
@@ -0,0 +1,220 @@
+import re
+from data_processor import open_pdf
+from text_chunking import SECTION_HEADING
+
+
+# Confidence at or above which local metadata is used without calling the LLM
+LOCAL_METADATA_CONFIDENCE = 0.75
+
+# How much each field contributes to the confidence score
+FIELD_WEIGHTS = {
+    "title": 0.35,
+    "authors": 0.3,
+    "publication_date": 0.15,
+    "abstract": 0.2,
+}
+
+MONTH_NUMBERS = {name: number for number, name in enumerate("jan feb mar apr may jun jul aug sep oct nov dec".split(), 1)}
+# Full month names or their abbreviations only, so "market 2020" or "decade 2010" is not a date
+MONTHS = (
+    "jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    "|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?"
+)
+
+DATE_PATTERN = re.compile(
+    rf"\b(?:(?P<iso>(?:19|20)\d{{2}}-\d{{2}}-\d{{2}})"
+    rf"|(?P<day_first>\d{{1,2}})\s+(?P<month_a>{MONTHS})\.?,?\s+(?P<year_a>(?:19|20)\d{{2}})"
+    rf"|(?P<month_b>{MONTHS})\.?\s+(?:(?P<day_b>\d{{1,2}}),?\s+)?(?P<year_b>(?:19|20)\d{{2}}))\b",
+    re.IGNORECASE,
+)
+
+ABSTRACT_START = re.compile(r"^\s*abstract\b[\s.:—–-]*", re.IGNORECASE | re.MULTILINE)
+
+# The abstract ends at a blank line, the keywords, or a numbered or
+# roman-numeral heading (SECTION_HEADING covers the other section headings)
+ABSTRACT_END = re.compile(
+    r"\n[ \t]*\n"
+    r"|^\s*(?:(?:\d+\.?|(?-i:[IVX]+)\.)\s+)?(?:introduction|keywords|index terms|ccs concepts)\b"
+    r"|^\s*(?-i:[IVX]+\.\s+[A-Z])",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Abstracts rarely run past ~400 words; a longer match ran into the body
+ABSTRACT_MAX_CHARS = 2500
+
+# A personal name: two to four capitalised words, allowing initials ("J.D.") and hyphens
+NAME_PATTERN = re.compile(r"^[A-Z][\w'’.-]*(?:\s+[A-Z][\w'’.-]*){1,3}$")
+
+# Rows naming institutions rather than people
+AFFILIATION_PATTERN = re.compile(
+    r"\b(universit|institut|college|laborator|department|school|research|cent(?:er|re)|academy|hospital|inc\b|corp)",
+    re.IGNORECASE,
+)
+
+# Producer/creator-generated titles that say nothing about the paper
+JUNK_TITLE_PATTERN = re.compile(r"(^microsoft word|\.(pdf|docx?|tex|dvi)$|^untitled$|^slide \d+)", re.IGNORECASE)
+
+
+def _find_abstract(text):
+    """Return `(abstract, score)`, or `(None, 0.0)` if the text has no usable abstract."""
+    start = ABSTRACT_START.search(text)
+    if not start:
+        return None, 0.0
+    body = text[start.end():]
+    ends = [match.start() for match in (ABSTRACT_END.search(body), SECTION_HEADING.search(body)) if match]
+    if ends:
+        body = body[:min(ends)]
+    abstract = " ".join(body.split())
+    if len(abstract) < 100:
+        return None, 0.0
+    if len(abstract) > ABSTRACT_MAX_CHARS:
+        # No clear end was found, so the tail is probably not part of the abstract
+        return abstract[:ABSTRACT_MAX_CHARS].rsplit(" ", 1)[0], 0.5
+    return abstract, 1.0
+
+
+def _parse_date(match):
+    """Return an ISO date (or year-month / year) for a DATE_PATTERN match."""
+    if match.group("iso"):
+        return match.group("iso")
+    if match.group("year_a"):
+        year, month, day = match.group("year_a"), match.group("month_a"), match.group("day_first")
+    else:
+        year, month, day = match.group("year_b"), match.group("month_b"), match.group("day_b")
+    month = MONTH_NUMBERS[month.lower()[:3]]
+    if day:
+        return f"{year}-{month:02d}-{int(day):02d}"
+    return f"{year}-{month:02d}"
+
+
+def _info_date(value):
+    """Convert a PDF info-dictionary date ("D:20240131...") to ISO format."""
+    match = re.match(r"D:(\d{4})(\d{2})?(\d{2})?", value or "")
+    if not match:
+        return None
+    return "-".join(part for part in match.groups() if part)
+
+
+def _split_authors(value):
+    """Split an author string on commas, semicolons and "and", keeping name-like parts."""
+    value = re.sub(r"[\d*†‡§¶]+", " ", value)
+    parts = re.split(r"\s*(?:,|;|\band\b|&)\s*", value)
+    names = [" ".join(part.split()) for part in parts]
+    return [name for name in names if NAME_PATTERN.match(name)]
+
+
+def _first_page_rows(page):
+    """
+    Return `(text, size, top)` for each visual row of text on a page, top to bottom.
+
+    Rows are rebuilt from words, which keep inter-word spacing that spans
+    can lose, and the word height stands in for the font size. Lines that
+    sit side by side at the same height and size, such as author columns,
+    are merged into one row separated by commas.
+    """
+    lines = {}
+    for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+        line = lines.setdefault((block_no, line_no), {"words": [], "size": 0.0, "top": y0, "left": x0})
+        line["words"].append(word)
+        line["size"] = max(line["size"], y1 - y0)
+        line["top"] = min(line["top"], y0)
+        line["left"] = min(line["left"], x0)
+
+    rows = []
+    for line in sorted(lines.values(), key=lambda line: (round(line["top"]), line["left"])):
+        text, size = " ".join(line["words"]), round(line["size"], 1)
+        if rows and abs(rows[-1][2] - line["top"]) < 2 and abs(rows[-1][1] - size) < 0.5:
+            rows[-1] = (f"{rows[-1][0]}, {text}", rows[-1][1], rows[-1][2])
+        else:
+            rows.append((text, size, line["top"]))
+    return rows
+
+
+def _layout_title_and_authors(page):
+    """
+    Find the title as the largest text in the top half of the first page,
+    and the authors in the rows below it that share the size of the first
+    row after the title.
+    """
+    rows = [row for row in _first_page_rows(page) if row[2] < page.rect.height * 0.5]
+    if not any(len(row[0]) >= 4 for row in rows):
+        return None, []
+
+    title_size = max(size for text, size, _ in rows if len(text) >= 4)
+    # The title is the first run of consecutive rows in the largest size
+    first = next(index for index, row in enumerate(rows) if abs(row[1] - title_size) < 0.5)
+    last = first
+    while last + 1 < len(rows) and abs(rows[last + 1][1] - title_size) < 0.5:
+        last += 1
+    title = " ".join(row[0] for row in rows[first:last + 1])
+
+    authors = []
+    author_rows = rows[last + 1:]
+    if author_rows:
+        author_size = author_rows[0][1]
+        for text, size, _ in author_rows:
+            if re.match(r"abstract\b", text, re.IGNORECASE):
+                break
+            if abs(size - author_size) < 0.5 and not AFFILIATION_PATTERN.search(text):
+                authors.extend(_split_authors(text))
+    return title, authors
+
+
+def extract_local_metadata(pdf_source):
+    """
+    Extract title, authors, publication date and abstract without an LLM.
+
+    Uses the PDF info dictionary and the font sizes and positions of the
+    text on the first page. `pdf_source` is a path or the PDF's bytes.
+
+    Returns `(metadata, confidence)`, where confidence in [0, 1] sums the
+    weights of the fields that were found, discounted for weaker evidence.
+    Callers should fall back to the LLM below LOCAL_METADATA_CONFIDENCE.
+    """
+    metadata = {"title": "N/A", "authors": [], "publication_date": "N/A", "abstract": "N/A"}
+    scores = dict.fromkeys(FIELD_WEIGHTS, 0.0)
+
+    with open_pdf(pdf_source) as pdf:
+        if pdf.page_count == 0:
+            return metadata, 0.0
+        info = pdf.metadata or {}
+        first_page = pdf[0]
+        layout_title, layout_authors = _layout_title_and_authors(first_page)
+        text = first_page.get_text()
+        if pdf.page_count > 1:
+            text += pdf[1].get_text()
+
+    info_title = (info.get("title") or "").strip()
+    if len(info_title) < 8 or JUNK_TITLE_PATTERN.search(info_title):
+        info_title = ""
+    if info_title and layout_title and info_title.lower() == layout_title.lower():
+        metadata["title"], scores["title"] = info_title, 1.0
+    elif info_title:
+        metadata["title"], scores["title"] = info_title, 0.8
+    elif layout_title and len(layout_title) >= 8:
+        metadata["title"], scores["title"] = layout_title, 0.7
+
+    info_authors = _split_authors(info.get("author") or "")
+    if info_authors and set(info_authors) <= set(layout_authors):
+        # The info dictionary often lists only the first author
+        metadata["authors"], scores["authors"] = layout_authors, 1.0
+    elif info_authors:
+        metadata["authors"], scores["authors"] = info_authors, 1.0
+    elif layout_authors:
+        metadata["authors"], scores["authors"] = layout_authors, 0.7
+
+    date_match = DATE_PATTERN.search(text)
+    if date_match:
+        metadata["publication_date"], scores["publication_date"] = _parse_date(date_match), 1.0
+    else:
+        # The creation date usually, but not always, matches publication
+        created = _info_date(info.get("creationDate"))
+        if created:
+            metadata["publication_date"], scores["publication_date"] = created, 0.5
+
+    abstract, score = _find_abstract(text)
+    if abstract:
+        metadata["abstract"], scores["abstract"] = abstract, score
+
+    confidence = sum(FIELD_WEIGHTS[field] * score for field, score in scores.items())
+    return metadata, round(confidence, 3)
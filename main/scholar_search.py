@@ -0,0 +1,185 @@
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode, urlparse
+import requests
+from bs4 import BeautifulSoup
+from telemetry import count, span
+
+
+# Scholar search endpoint; point it at a local server for benchmarks
+SCHOLAR_URL = os.environ.get("SCHOLAR_URL", "https://scholar.google.com/scholar")
+
+DEFAULT_SEARCH_CACHE_DIR = os.path.join(".cache", "scholar")
+
+# Seconds a cached result page stays fresh
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 24 * 3600))
+
+# Minimum seconds between two requests to the same host
+SCHOLAR_MIN_INTERVAL = float(os.environ.get("SCHOLAR_MIN_INTERVAL", 1.0))
+
+# Scholar lists ten results per page and stops serving pages after 100 results
+RESULTS_PER_PAGE = 10
+MAX_RESULT_PAGES = 10
+
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# lxml parses result pages several times faster than the stdlib parser
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+
+class SearchCache:
+    """On-disk cache of result pages keyed by their URL, expiring `ttl` seconds after they were fetched."""
+
+    def __init__(self, directory=DEFAULT_SEARCH_CACHE_DIR, ttl=SEARCH_CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, url):
+        """Return the cached HTML for `url`, or None if missing or expired."""
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl is not None and entry["fetched_at"] < time.time() - self.ttl:
+            return None
+        return entry["html"]
+
+    def set(self, url, html):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": url, "fetched_at": time.time(), "html": html}, f)
+        os.replace(tmp_path, path)
+
+
+class HostRateLimiter:
+    """Space requests to each host at least `min_interval` seconds apart, across threads."""
+
+    def __init__(self, min_interval=SCHOLAR_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def parse_result_page(html):
+    """Return `(result_count, pdf_links)` for one Scholar result page."""
+    soup = BeautifulSoup(html, HTML_PARSER)
+    links = []
+    for result in soup.select(".gs_or_ggsm a"):
+        href = result.get("href")
+        if href and href.endswith(".pdf"):  # Ensure the link ends with ".pdf"
+            links.append(href)
+    return len(soup.select(".gs_r")), links
+
+
+class ScholarSearch:
+    """
+    Google Scholar search that pages through results until enough PDF links are found.
+
+    Result pages are cached on disk, so repeating a search within the TTL
+    makes no request. Requests to one host are spaced by a shared rate
+    limiter, including when `search_many` runs several queries at once,
+    and transient failures are retried with backoff.
+    """
+
+    def __init__(self, base_url=SCHOLAR_URL, cache=None, rate_limiter=None, session=None, max_workers=4,
+                 timeout=(10, 30), max_retries=3, backoff=2.0):
+        self.base_url = base_url
+        self.cache = cache if cache is not None else SearchCache()
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.session = session or requests.Session()
+        self.session.headers.update(HEADERS)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def page_url(self, query, start=0):
+        params = {"q": query, "start": start} if start else {"q": query}
+        return f"{self.base_url}?{urlencode(params)}"
+
+    def fetch_page(self, query, start=0):
+        """Return the HTML of one result page, from the cache when fresh, or None if it could not be fetched."""
+        url = self.page_url(query, start)
+        html = self.cache.get(url)
+        count("pipeline_cache_requests_total", cache="search", result="miss" if html is None else "hit")
+        if html is not None:
+            return html
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(url)
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                status, error = None, e
+            else:
+                if response.status_code == 200:
+                    self.cache.set(url, response.text)
+                    return response.text
+                status, error = response.status_code, f"HTTP {response.status_code}"
+            if (status is not None and status not in RETRY_STATUSES) or attempt == self.max_retries:
+                print(f"Search request failed for {url}: {error}")
+                return None
+            retry_after = response.headers.get("Retry-After", "") if status else ""
+            delay = float(retry_after) if retry_after.isdigit() else self.backoff * (2 ** attempt)
+            print(f"Retrying search {url} in {delay:.1f}s ({error})")
+            time.sleep(delay)
+        return None
+
+    def search(self, query, num_results=5):
+        """Return up to `num_results` distinct PDF links for `query`, following result pages as needed."""
+        links = []
+        with span("search", query=query) as attributes:
+            for page in range(MAX_RESULT_PAGES):
+                html = self.fetch_page(query, page * RESULTS_PER_PAGE)
+                if html is None:
+                    break
+                results, page_links = parse_result_page(html)
+                links.extend(link for link in page_links if link not in links)
+                if len(links) >= num_results or results < RESULTS_PER_PAGE:
+                    break  # Enough links, or this was the last page
+            attributes.update(pages=page + 1, results=min(len(links), num_results))
+        return links[:num_results]
+
+    def search_many(self, queries, num_results=5):
+        """Search several queries concurrently, yielding `(query, links)` as each one finishes."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.search, query, num_results): query for query in queries}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+
+_default_search = None
+_default_search_lock = threading.Lock()
+
+
+def get_scholar_search():
+    """Return the process-wide search, caching pages under `SEARCH_CACHE_DIR` on first use."""
+    global _default_search
+    with _default_search_lock:
+        if _default_search is None:
+            _default_search = ScholarSearch(
+                cache=SearchCache(os.environ.get("SEARCH_CACHE_DIR", DEFAULT_SEARCH_CACHE_DIR))
+            )
+    return _default_search
@@ -1,51 +1,38 @@
+import hashlib
+import os
 import streamlit as st
-from datetime import datetime
-from data_processor import extract_text_from_pdf, process_pdfs, classify_topic, extract_keywords
-from langgraph_workflow import build_langgraph_workflow
+from data_processor import extract_text_from_pdf, load_pdf_documents, classify_topic, extract_keywords
+from langgraph_workflow import document_row, run_document_tasks
+from llm_scheduler import INTERACTIVE
 from data_downloader import download_papers_from_google_scholar
-from langchain_core.messages import HumanMessage
-from google.cloud import bigquery
 
 
-# To be Completed
+# Pages of each PDF sent to the workflow; long documents are summarized
+# chunk by chunk in parallel, so latency does not grow linearly with this
+MAX_PAGES = 30
 
-def store_in_bigquery(dataset_id, table_id, data):
-    """
-    Store structured data in BigQuery.
-    Args:
-        dataset_id (str): The BigQuery dataset ID.
-        table_id (str): The BigQuery table ID.
-        data (dict): The data to insert into BigQuery.
-    """
-    client = bigquery.Client()
-
-    table_ref = f"{client.project}.{dataset_id}.{table_id}"
 
-    # Add a timestamp for when the data is inserted
-    data["created_at"] = datetime.utcnow().isoformat()
+@st.cache_data(show_spinner=False, max_entries=32)
+def extract_uploaded_text(digest, _pdf_bytes, max_pages=MAX_PAGES):
+    """Extract an upload's text once per content hash; the bytes themselves are not hashed."""
+    return extract_text_from_pdf(_pdf_bytes, max_pages=max_pages)
 
-    # Insert rows into BigQuery
-    errors = client.insert_rows_json(table_ref, [data])
-
-    if errors:
-        print(f"Error inserting data into BigQuery: {errors}")
-    else:
-        print("Data successfully inserted into BigQuery.")
 
-def process_with_selected_tasks(text, selected_tasks):
+def process_with_selected_tasks(text, selected_tasks, pdf_source=None, on_summary_token=None):
     """
     Process the text based on the selected tasks and store results in BigQuery.
-    """
-    workflow = build_langgraph_workflow()
-    if workflow is None:
-        return {"Error": "Workflow timed out. Please try again."}
-
-    state = {"messages": [HumanMessage(content=text)]}
-    final_state = workflow.invoke(state)
 
-    # Debugging
-    print("Final State Debug:", final_state)
+    When `pdf_source` (a path or the PDF's bytes) is given, metadata is first
+    read locally from the PDF, and the LLM is only asked for it when the
+    local result is not confident enough. `on_summary_token` is called with
+    each summary token as it is generated.
 
+    Results from earlier runs on the same text are reused, so adding tasks
+    later only runs the new ones.
+    """
+    final_state = run_document_tasks(
+        text, selected_tasks, pdf_source=pdf_source, on_summary_token=on_summary_token, priority=INTERACTIVE
+    )
 
     results = {}
     if "Summary" in selected_tasks:
@@ -57,6 +44,8 @@ def process_with_selected_tasks(text, selected_tasks):
             "Authors": metadata.get("authors", []),
             "Publication Date": metadata.get("publication_date", "N/A"),
             "Abstract": metadata.get("abstract", "N/A"),
+            "Key Findings": metadata.get("key_findings", []),
+            "Methodology": metadata.get("methodology", "N/A"),
         }
     else:
         # Ensure Metadata key is always present
@@ -65,23 +54,19 @@ def process_with_selected_tasks(text, selected_tasks):
             "Authors": [],
             "Publication Date": "N/A",
             "Abstract": "N/A",
+            "Key Findings": [],
+            "Methodology": "N/A",
         }
     if "Sentiment Analysis" in selected_tasks:
         results["Sentiment"] = final_state.get("sentiment", "Unknown")
     if "Entity Recognition" in selected_tasks:
         results["Entities"] = final_state.get("entities", {})
+    if final_state.get("errors"):
+        # Nodes that ran out of time; everything else above is still valid
+        results["Errors"] = final_state["errors"]
 
     # Prepare data for BigQuery
-    bigquery_data = {
-        "document_id": hash(text),  # Use hash of the text as a unique document ID
-        "title": results.get("Metadata", {}).get("Title", "N/A"),
-        "authors": results.get("Metadata", {}).get("Authors", []),
-        "publication_date": results.get("Metadata", {}).get("Publication Date", "N/A"),
-        "abstract": results.get("Metadata", {}).get("Abstract", "N/A"),
-        "summary": results.get("Summary", "N/A"),
-        "sentiment": results.get("Sentiment", "Unknown"),
-        "entities": results.get("Entities", {}),
-    }
+    bigquery_data = document_row(text, final_state)
 
     # Send data to BigQuery
     # store_in_bigquery("llm_metadata", "documents", bigquery_data)
@@ -116,18 +101,34 @@ def main():
         )
 
         if uploaded_file is not None:
-            # Save the uploaded file to disk
-            with open("uploaded_file.pdf", "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            st.success("File uploaded successfully!")
-
-            # Extract text from the uploaded PDF
-            text = extract_text_from_pdf("uploaded_file.pdf", max_pages=10)
-            st.text_area("Extracted Text", text, height=300)
-
-            # Process with LangGraph based on selected tasks
+            # Work on the upload's buffer directly; nothing is written to disk
+            pdf_bytes = uploaded_file.getbuffer()
+            digest = hashlib.sha256(pdf_bytes).hexdigest()
+            text = extract_uploaded_text(digest, pdf_bytes)
+            with st.expander("Extracted Text"):
+                st.text(text)
+
+            # Results are kept per upload and task selection, so reruns only redraw them
+            results_key = ("upload_results", digest, tuple(selected_tasks))
             if st.button("Process Uploaded PDF"):
-                results = process_with_selected_tasks(text, selected_tasks)
+                summary_placeholder = st.empty()
+                streamed = []
+
+                def show_token(token):
+                    streamed.append(token)
+                    summary_placeholder.markdown("".join(streamed))
+
+                results = process_with_selected_tasks(
+                    text,
+                    selected_tasks,
+                    pdf_source=pdf_bytes,
+                    on_summary_token=show_token if "Summary" in selected_tasks else None,
+                )
+                summary_placeholder.empty()
+                st.session_state[results_key] = results
+
+            results = st.session_state.get(results_key)
+            if results:
                 for task, output in results.items():
                     if task == "Metadata":
                         st.subheader(task)
@@ -135,6 +136,11 @@ def main():
                         st.write(f"**Authors**: {', '.join(output.get('Authors', []))}")
                         st.write(f"**Publication Date**: {output.get('Publication Date', 'N/A')}")
                         st.write(f"**Abstract**: {output.get('Abstract', 'N/A')}")
+                        if output.get("Key Findings"):
+                            st.write("**Key Findings**:")
+                            st.markdown("\n".join(f"- {finding}" for finding in output["Key Findings"]))
+                        if output.get("Methodology", "N/A") != "N/A":
+                            st.write(f"**Methodology**: {output['Methodology']}")
                     else:
                         st.subheader(task)
                         st.write(output)
@@ -167,12 +173,14 @@ def main():
 
                     # Process the downloaded PDFs
                     st.write("Processing downloaded papers...")
-                    processed_texts = process_pdfs(base_folder, query, max_pages=10, num_files=num_papers)
+                    documents = load_pdf_documents(base_folder, query, max_pages=MAX_PAGES, num_files=num_papers)
 
                     # Display results for each document
-                    for i, text in enumerate(processed_texts, 1):
+                    for i, document in enumerate(documents, 1):
                         st.subheader(f"Document {i}")
-                        results = process_with_selected_tasks(text, selected_tasks)
+                        results = process_with_selected_tasks(
+                            document["text"], selected_tasks, pdf_source=document["path"]
+                        )
                         for task, output in results.items():
                             if task == "Metadata":
                                 st.subheader(f"{task} (Document {i})")
@@ -180,6 +188,11 @@ def main():
                                 st.write(f"**Authors**: {', '.join(output.get('Authors', []))}")
                                 st.write(f"**Publication Date**: {output.get('Publication Date', 'N/A')}")
                                 st.write(f"**Abstract**: {output.get('Abstract', 'N/A')}")
+                                if output.get("Key Findings"):
+                                    st.write("**Key Findings**:")
+                                    st.markdown("\n".join(f"- {finding}" for finding in output["Key Findings"]))
+                                if output.get("Methodology", "N/A") != "N/A":
+                                    st.write(f"**Methodology**: {output['Methodology']}")
                             else:
                                 st.write(f"**{task}**: {output}")
 
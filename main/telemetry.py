@@ -0,0 +1,243 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Histogram buckets for span durations, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# USD per million (prompt, completion) tokens, for cost estimates
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Telemetry:
+    """
+    In-process tracing spans and metrics for the pipeline.
+
+    Spans nest through a context variable, so spans opened in LangGraph
+    nodes and their asyncio tasks attach to the span of the run that
+    started them. Each finished span is observed in the
+    `pipeline_span_seconds` histogram and, with `trace_path`, appended to a
+    JSONL trace file whose records carry OpenTelemetry-style trace, span
+    and parent IDs. Metrics render in the Prometheus text format, for a
+    node_exporter textfile (`metrics_path`) or the `serve` HTTP endpoint.
+    """
+
+    def __init__(self, trace_path=None, metrics_path=None):
+        self.metrics_path = metrics_path
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._trace_file = None
+        if trace_path:
+            if os.path.dirname(trace_path):
+                os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+            self._trace_file = open(trace_path, "a", encoding="utf-8")
+
+    def count(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation in a histogram."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a block as a span named `name`.
+
+        Yields the span's attribute dict, so the block can add attributes
+        it only learns while running (bytes, pages, tokens).
+        """
+        parent = _current_span.get()
+        span = {
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent["span_id"] if parent else None,
+        }
+        token = _current_span.set(span)
+        started_at = time.time()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as e:
+            status = "error"
+            attributes["error"] = f"{e.__class__.__name__}: {e}"[:500]
+            raise
+        finally:
+            _current_span.reset(token)
+            duration = time.perf_counter() - start
+            self.observe("pipeline_span_seconds", duration, span=name)
+            if status == "error":
+                self.count("pipeline_span_errors_total", span=name)
+            if self._trace_file is not None:
+                record = {**span, "name": name, "start_time": started_at, "duration_ms": round(duration * 1000, 3),
+                          "status": status, "attributes": attributes}
+                line = json.dumps(record, default=str) + "\n"
+                with self._lock:
+                    self._trace_file.write(line)
+
+    def record_llm_usage(self, model, prompt_tokens, completion_tokens):
+        """Count the tokens of one LLM call and its estimated cost."""
+        self.count("pipeline_llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+        self.count("pipeline_llm_tokens_total", completion_tokens, model=model, kind="completion")
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+        self.count("pipeline_llm_cost_usd_total", cost, model=model)
+        return cost
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f"{name}_bucket{_format_labels(labels, le=f'{bound:g}')} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {histogram[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return token, cost, cache and per-span totals as a plain dict."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        def total(metric, **match):
+            return sum(value for (name, labels), value in counters.items()
+                       if name == metric and set(_label_key(match)) <= set(labels))
+
+        spans = {}
+        for (name, labels), histogram in histograms.items():
+            if name == "pipeline_span_seconds" and histogram[-1]:
+                spans[dict(labels)["span"]] = {"count": histogram[-1], "mean_seconds": histogram[-2] / histogram[-1]}
+        caches = {dict(labels)["cache"] for (name, labels) in counters if name == "pipeline_cache_requests_total"}
+        return {
+            "prompt_tokens": total("pipeline_llm_tokens_total", kind="prompt"),
+            "completion_tokens": total("pipeline_llm_tokens_total", kind="completion"),
+            "cost_usd": total("pipeline_llm_cost_usd_total"),
+            "bytes_downloaded": total("pipeline_download_bytes_total"),
+            "pages_extracted": total("pipeline_pages_extracted_total"),
+            "cache_hit_rates": {
+                cache: total("pipeline_cache_requests_total", cache=cache, result="hit")
+                / max(1, total("pipeline_cache_requests_total", cache=cache))
+                for cache in caches
+            },
+            "spans": spans,
+        }
+
+    def flush(self):
+        """Flush the trace file and rewrite the metrics textfile."""
+        if self._trace_file is not None:
+            with self._lock:
+                self._trace_file.flush()
+        if self.metrics_path:
+            if os.path.dirname(self.metrics_path):
+                os.makedirs(os.path.dirname(self.metrics_path), exist_ok=True)
+            tmp_path = f"{self.metrics_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.metrics_path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve the metrics at http://host:port/metrics from a daemon thread."""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+_default_telemetry = None
+_default_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """
+    Return the process-wide telemetry, configured from the environment on first use.
+
+    TELEMETRY_TRACE_PATH enables the JSONL trace file, TELEMETRY_METRICS_PATH
+    the Prometheus textfile (rewritten on flush and at exit) and
+    TELEMETRY_METRICS_PORT the HTTP endpoint.
+    """
+    global _default_telemetry
+    with _default_telemetry_lock:
+        if _default_telemetry is None:
+            _default_telemetry = Telemetry(
+                trace_path=os.environ.get("TELEMETRY_TRACE_PATH"),
+                metrics_path=os.environ.get("TELEMETRY_METRICS_PATH"),
+            )
+            port = os.environ.get("TELEMETRY_METRICS_PORT")
+            if port:
+                _default_telemetry.serve(int(port))
+            atexit.register(_default_telemetry.flush)
+    return _default_telemetry
+
+
+def span(name, **attributes):
+    """Open a span on the process-wide telemetry."""
+    return get_telemetry().span(name, **attributes)
+
+
+def count(name, value=1, **labels):
+    """Add to a counter on the process-wide telemetry."""
+    get_telemetry().count(name, value, **labels)
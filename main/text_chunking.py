@@ -0,0 +1,125 @@
+import re
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+
+# Rough characters-per-token ratio for English text when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+# Lines that look like section headings: numbered ("3.2 Results") or a known section name
+SECTION_HEADING = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?\s+[A-Z][^\n]{0,80}"
+    r"|(?:abstract|introduction|related work|background|methods?|methodology|materials and methods"
+    r"|experiments?|evaluation|results|discussion|conclusions?|references|acknowledge?ments?)"
+    r"\b[^\n]{0,40})\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+_encodings = {}
+
+
+def _get_encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # The encoding files are downloaded on first use, which fails offline
+            print(f"tiktoken encoding unavailable, estimating tokens from characters: {e}")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Return the number of tokens `text` uses for `model` (estimated without tiktoken)."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _split_tokens(text, max_tokens, model):
+    """Split `text` into pieces of at most `max_tokens` tokens."""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-4o"):
+    """Return the leading part of `text` that fits in `max_tokens` tokens."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    return _split_tokens(text, max_tokens, model)[0]
+
+
+def _tail(text, max_tokens, model):
+    """Return the trailing part of `text` that fits in `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return text[-max_tokens * CHARS_PER_TOKEN:]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[-max_tokens:])
+
+
+def split_sections(text):
+    """Split text at lines that look like section headings, keeping each heading with its body."""
+    starts = [match.start() for match in SECTION_HEADING.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    return [text[a:b] for a, b in zip(starts, starts[1:]) if text[a:b].strip()]
+
+
+def chunk_text(text, chunk_tokens=3000, overlap_tokens=200, model="gpt-4o"):
+    """
+    Split text into chunks of at most about `chunk_tokens` tokens.
+
+    Chunks are packed from whole lines and prefer to break at section
+    headings; lines larger than the budget are split by tokens. Each
+    chunk after the first starts with the last `overlap_tokens` tokens of
+    the previous one, so statements that straddle a boundary are kept.
+    """
+    budget = max(chunk_tokens - overlap_tokens, 1)
+    chunks = []
+    current, current_tokens = [], 0
+
+    def close():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append("".join(current))
+        current, current_tokens = [], 0
+
+    for section in split_sections(text):
+        section_tokens = count_tokens(section, model)
+        # Start a new chunk at a heading unless the whole section still fits
+        if current and current_tokens + section_tokens > budget:
+            close()
+        for line in section.splitlines(keepends=True):
+            line_tokens = count_tokens(line, model)
+            if line_tokens > budget:
+                close()
+                pieces = _split_tokens(line, budget, model)
+                chunks.extend(pieces[:-1])
+                current, current_tokens = [pieces[-1]], count_tokens(pieces[-1], model)
+                continue
+            if current_tokens + line_tokens > budget:
+                close()
+            current.append(line)
+            current_tokens += line_tokens
+    close()
+
+    if overlap_tokens > 0:
+        chunks = chunks[:1] + [
+            _tail(previous, overlap_tokens, model) + chunk for previous, chunk in zip(chunks, chunks[1:])
+        ]
+    return chunks
@@ -0,0 +1,130 @@
+import json
+import os
+import re
+import threading
+
+
+# Topic -> {keyword or phrase: weight}. Phrases match on word boundaries and
+# case-insensitively; all-uppercase acronyms ("AI") match case-sensitively.
+DEFAULT_TAXONOMY = {
+    "Artificial Intelligence": {
+        "machine learning": 3,
+        "deep learning": 3,
+        "neural network": 3,
+        "artificial intelligence": 3,
+        "reinforcement learning": 3,
+        "natural language processing": 3,
+        "large language model": 3,
+        "computer vision": 2,
+        "transformer": 1,
+        "AI": 1,
+        "LLM": 2,
+    },
+    "Finance": {
+        "finance": 2,
+        "financial": 2,
+        "economy": 2,
+        "economic": 1,
+        "stock market": 3,
+        "monetary policy": 3,
+        "asset pricing": 3,
+        "inflation": 2,
+        "banking": 2,
+        "portfolio": 1,
+    },
+    "Biology/Health": {
+        "biology": 2,
+        "health": 1,
+        "clinical": 2,
+        "patient": 2,
+        "disease": 2,
+        "protein": 2,
+        "genome": 3,
+        "gene expression": 3,
+        "medical": 2,
+        "cell": 1,
+    },
+}
+
+DEFAULT_TOPIC = "General"
+
+
+class TopicClassifier:
+    """
+    Weighted keyword topic classifier compiled into a single regex.
+
+    All keywords of every topic are alternatives of one pattern, each in
+    its own group, so a document is scanned once and every match is
+    attributed to its topics through `match.lastindex` without lowercasing
+    or copying the text.
+    """
+
+    def __init__(self, taxonomy=None, default_topic=DEFAULT_TOPIC, min_score=1):
+        self.taxonomy = taxonomy or DEFAULT_TAXONOMY
+        self.default_topic = default_topic
+        self.min_score = min_score
+        self.topics = list(self.taxonomy)
+
+        # Each distinct keyword becomes one group; its topics and weights are looked up by group
+        weights = {}
+        for topic, keywords in self.taxonomy.items():
+            for keyword, weight in keywords.items():
+                weights.setdefault(keyword, []).append((topic, weight))
+        # Longest first, so a phrase wins over a keyword it starts with
+        self._keywords = sorted(weights, key=len, reverse=True)
+        self._weights = [weights[keyword] for keyword in self._keywords]
+
+        alternatives = []
+        for keyword in self._keywords:
+            pattern = r"[\s-]+".join(re.escape(word) for word in keyword.split())
+            if keyword.isupper():
+                pattern = f"(?-i:{pattern})"
+            alternatives.append(f"({pattern}s?)")
+        self._pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE)
+
+    @classmethod
+    def from_json(cls, path, **kwargs):
+        """Build a classifier from a JSON file holding a taxonomy dict."""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def score(self, text):
+        """Return the weighted keyword score of every topic for `text`."""
+        scores = dict.fromkeys(self.topics, 0)
+        weights = self._weights
+        for match in self._pattern.finditer(text):
+            for topic, weight in weights[match.lastindex - 1]:
+                scores[topic] += weight
+        return scores
+
+    def classify(self, text):
+        """Return the highest-scoring topic, or the default topic below `min_score`."""
+        return self._best(self.score(text))
+
+    def _best(self, scores):
+        topic = max(self.topics, key=scores.__getitem__, default=None)
+        if topic is None or scores[topic] < self.min_score:
+            return self.default_topic
+        return topic
+
+    def score_batch(self, texts):
+        """Return the topic scores of each text."""
+        return [self.score(text) for text in texts]
+
+    def classify_batch(self, texts):
+        """Return the topic of each text."""
+        return [self._best(scores) for scores in self.score_batch(texts)]
+
+
+_default_classifier = None
+_default_classifier_lock = threading.Lock()
+
+
+def get_topic_classifier():
+    """Return the process-wide classifier, using `TOPIC_TAXONOMY_PATH` if set."""
+    global _default_classifier
+    with _default_classifier_lock:
+        if _default_classifier is None:
+            path = os.environ.get("TOPIC_TAXONOMY_PATH")
+            _default_classifier = TopicClassifier.from_json(path) if path else TopicClassifier()
+    return _default_classifier
@@ -1,16 +1,20 @@
+import asyncio
+import hashlib
 import re
+import threading
+
+
+VALIDATION_RULES = {
+    "names": r"^[A-Za-z ]+$",
+    "dates": r"^\d{4}-\d{2}-\d{2}$",
+    "amounts": r"^\$\d+$",
+}
 
 
 def validate_extracted_data(data):
     """Validate extracted data using regex patterns."""
-    validation_rules = {
-        "names": r"^[A-Za-z ]+$",
-        "dates": r"^\d{4}-\d{2}-\d{2}$",
-        "amounts": r"^\$\d+$",
-    }
-
     errors = {}
-    for key, pattern in validation_rules.items():
+    for key, pattern in VALIDATION_RULES.items():
         for value in data.get(key, []):
             if not re.match(pattern, value):
                 errors[key] = f"Invalid {key}: {value}"
@@ -19,3 +23,41 @@ def validate_extracted_data(data):
         raise ValueError(f"Validation failed: {errors}")
 
     return True
+
+
+def stable_document_id(text):
+    """Return a document ID derived from the text that is the same in every process."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Return the shared background event loop, starting it on first use."""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop.is_closed():
+            _event_loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_event_loop.run_forever, name="pipeline-event-loop", daemon=True
+            )
+            thread.start()
+    return _event_loop
+
+
+def run_async(coro, timeout=None):
+    """
+    Run a coroutine on the shared background event loop and wait for the result.
+
+    Async clients keep their connection pools bound to the loop they were first
+    used on, so workflow runs share one long-lived loop instead of calling
+    `asyncio.run` (and tearing the loop down) for every document.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    try:
+        return future.result(timeout=timeout)
+    except BaseException:
+        future.cancel()
+        raise